@@ -0,0 +1,53 @@
+import hashlib
+import time
+
+from cache import TTLCache
+
+
+def token_digest(token):
+    """Return digest of the token, so raw tokens are not kept in memory."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenCache:
+    """
+    Cache of verified token claims by token digest.
+
+    Entries expire after ttl seconds or when the token expires, whichever
+    comes first, so a token is verified once per worker while it is valid.
+
+    Args:
+        maxsize (int): maximum number of cached tokens
+        ttl (float): maximum time to live of entries in seconds, 0 disables cache
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._claims = TTLCache(maxsize, ttl)
+
+    def get(self, token):
+        """Return verified claims of the token or None."""
+        claims = self._claims.get(token_digest(token))
+        if claims is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return claims
+
+    def set(self, token, claims, expires):
+        """
+        Cache verified claims of the token.
+
+        Args:
+            token (str): encoded token
+            claims (dict): verified claims
+            expires (float): expiration timestamp of the token
+        """
+        ttl = min(self.ttl, expires - time.time())
+        if ttl > 0:
+            self._claims.set(token_digest(token), claims, ttl)
+
+    def as_dict(self):
+        return {"size": len(self._claims), "hits": self.hits, "misses": self.misses}
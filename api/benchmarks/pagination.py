@@ -0,0 +1,60 @@
+"""
+Compare offset and keyset pagination of the events query on deep pages.
+
+Run from the api directory:
+    python -m benchmarks.pagination --events 1000000
+"""
+import argparse
+import asyncio
+
+from graphql_relay.connection.arrayconnection import offset_to_cursor
+
+from benchmarks.utils import get_database, measure, seed_events
+from pagination import MotorConnectionField, MotorQuery, Pagination, keyset_to_cursor
+from queries import EventConnection, get_event_projection
+
+
+async def main(events, page, repeat, database):
+    db = get_database(database)
+    await seed_events(db, events)
+    # the query of resolve_events without the response cache of the pages
+    query = MotorQuery(
+        db.events,
+        [],
+        sort=[("changed_date", -1), ("id", -1)],
+        projection=get_event_projection(),
+    )
+
+    print(f"{'depth':>10} {'offset, ms':>12} {'keyset, ms':>12}")
+    depths = {0, 1000, 10000, 100000, events // 2, events - page}
+    for depth in sorted(depth for depth in depths if depth <= events - page):
+        offset_args = {"pagination": Pagination.OFFSET.value, "first": page}
+        keyset_args = {"pagination": Pagination.KEYSET.value, "first": page}
+        if depth:
+            offset_args["after"] = offset_to_cursor(depth)
+            doc = await query.aggregate(skip=depth - 1, limit=1).next()
+            keyset_args["after"] = keyset_to_cursor(query.sort, doc)
+
+        offset = await measure(
+            lambda: MotorConnectionField.resolve_connection(
+                EventConnection, offset_args, query
+            ),
+            repeat,
+        )
+        keyset = await measure(
+            lambda: MotorConnectionField.resolve_connection(
+                EventConnection, keyset_args, query
+            ),
+            repeat,
+        )
+        print(f"{depth:>10} {offset:>12.2f} {keyset:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--database", default="benchmark")
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.page, args.repeat, args.database))
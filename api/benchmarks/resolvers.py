@@ -0,0 +1,121 @@
+"""
+Measure per-field overhead of GraphQL middleware on a large events page.
+
+The page is resolved with the per-field middleware which filled the context
+before and with the context built once per request.
+
+Run from the api directory:
+    python -m benchmarks.resolvers --events 10000 --page 100
+"""
+import argparse
+import asyncio
+from types import SimpleNamespace
+
+import pytz
+from graphql import graphql
+from graphql.execution.executors.asyncio import AsyncioExecutor
+
+from benchmarks.utils import get_database, measure, seed_events
+from loaders import Loaders
+from main import persisted_queries, schema
+
+QUERY = """
+query Events($first: Int) {
+  events(first: $first) {
+    edges {
+      node {
+        id
+        eventType
+        description
+        address
+        longitude
+        latitude
+        createdBy { id username }
+        createdDate
+        changedDate
+      }
+    }
+  }
+}
+"""
+
+
+async def database_middleware(next, root, info, **args):
+    if "db" not in info.context:
+        info.context["db"] = info.context["request"].db
+    if "loaders" not in info.context:
+        info.context["loaders"] = info.context["request"].loaders
+    return next(root, info, **args)
+
+
+async def user_info_middleware(next, root, info, **args):
+    if "credentials" not in info.context:
+        info.context["credentials"] = info.context["request"].credentials
+    if "timezone" not in info.context:
+        info.context["timezone"] = info.context["request"].timezone
+    return next(root, info, **args)
+
+
+async def execute(page, context, middleware=None):
+    result = await graphql(
+        schema,
+        QUERY,
+        context_value=context,
+        variable_values={"first": page},
+        middleware=middleware,
+        executor=AsyncioExecutor(),
+        return_promise=True,
+        backend=persisted_queries,
+    )
+    if result.errors:
+        raise result.errors[0]
+    return result
+
+
+async def main(events, page, repeat, database):
+    db = get_database(database)
+    await seed_events(db, events)
+    credentials = {"id": "00000000-0000-0000-0000-000000000000", "username": "user"}
+
+    def request_context():
+        request = SimpleNamespace(
+            db=db, loaders=Loaders(db), credentials=credentials, timezone=pytz.utc
+        )
+        return {"request": request}
+
+    def built_context():
+        return {
+            "db": db,
+            "loaders": Loaders(db),
+            "credentials": credentials,
+            "timezone": pytz.utc,
+        }
+
+    fields = 0
+
+    def count_fields(next, root, info, **args):
+        nonlocal fields
+        fields += 1
+        return next(root, info, **args)
+
+    await execute(page, built_context(), [count_fields])
+
+    middleware = [database_middleware, user_info_middleware]
+    before = await measure(lambda: execute(page, request_context(), middleware), repeat)
+    after = await measure(lambda: execute(page, built_context()), repeat)
+
+    print(f"{'':>12} {'page, ms':>10} {'field, us':>10}")
+    print(f"{'middleware':>12} {before:>10.2f} {before * 1000 / fields:>10.2f}")
+    print(f"{'context':>12} {after:>10.2f} {after * 1000 / fields:>10.2f}")
+    print(f"resolved fields: {fields}")
+    print(f"overhead per field: {(before - after) * 1000 / fields:.2f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--database", default="benchmark")
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.page, args.repeat, args.database))
@@ -0,0 +1,79 @@
+"""
+Compare the former address regex search with the events text index search.
+
+Run from the api directory:
+    python -m benchmarks.search --events 1000000
+"""
+import argparse
+import asyncio
+import re
+
+from benchmarks.utils import WORDS, get_database, measure, seed_events
+from pagination import MotorConnectionField, MotorQuery
+from queries import EventConnection, get_event_projection
+
+
+def get_regex_query(db, value):
+    pattern = re.compile(f".*{value}.*", re.IGNORECASE)
+    return MotorQuery(
+        db.events,
+        [{"$match": {"address": pattern}}],
+        sort=[("changed_date", -1), ("id", -1)],
+        projection=get_event_projection(),
+    )
+
+
+def get_text_query(db, value):
+    # the query of resolve_events without the response cache of the pages
+    return MotorQuery(
+        db.events,
+        [
+            {"$match": {"$and": [{"$text": {"$search": value}}]}},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ],
+        sort=[("score", -1), ("changed_date", -1), ("id", -1)],
+        projection=get_event_projection(),
+    )
+
+
+async def main(events, page, repeat, database):
+    db = get_database(database)
+    await seed_events(db, events)
+    args = {"first": page}
+
+    print(
+        f"{'search':>10} {'regex, ms':>12} {'text, ms':>12}"
+        f" {'regex count, ms':>16} {'text count, ms':>16}"
+    )
+    for value in WORDS[:3]:
+        regex_query = get_regex_query(db, value)
+        text_query = get_text_query(db, value)
+
+        regex = await measure(
+            lambda: MotorConnectionField.resolve_connection(
+                EventConnection, args, regex_query
+            ),
+            repeat,
+        )
+        text = await measure(
+            lambda: MotorConnectionField.resolve_connection(
+                EventConnection, args, text_query
+            ),
+            repeat,
+        )
+        regex_count = await measure(regex_query.count, repeat)
+        text_count = await measure(text_query.count, repeat)
+        print(
+            f"{value:>10} {regex:>12.2f} {text:>12.2f}"
+            f" {regex_count:>16.2f} {text_count:>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--database", default="benchmark")
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.page, args.repeat, args.database))
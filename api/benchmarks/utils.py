@@ -0,0 +1,59 @@
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from database import create_client, ensure_indexes
+from main import DATABASE_HOST, DATABASE_PORT
+
+BATCH_SIZE = 10000
+
+WORDS = ["street", "avenue", "square", "park", "bridge", "market", "station"]
+
+
+def get_database(name):
+    client = create_client(DATABASE_HOST, DATABASE_PORT)
+    return client[name]
+
+
+def gen_events(count, user):
+    now = datetime.now()
+    for idx in range(count):
+        word = random.choice(WORDS)
+        yield {
+            "id": uuid.uuid4(),
+            "event_type": random.randrange(1, 8),
+            "description": f"Something happened near the {word} {idx}",
+            "address": f"{word}-{idx}",
+            "location": {
+                "type": "Point",
+                "coordinates": [random.uniform(-180, 180), random.uniform(-90, 90)],
+            },
+            "created_by": user,
+            "created_date": now - timedelta(seconds=idx),
+            "changed_date": now - timedelta(seconds=idx),
+        }
+
+
+async def seed_events(db, count):
+    """Fill events collection with count synthetic events, reuse existing ones."""
+    if await db.events.estimated_document_count() != count:
+        await db.events.drop()
+        user = {"id": str(uuid.uuid4()), "username": "benchmark"}
+        batch = []
+        for doc in gen_events(count, user):
+            batch.append(doc)
+            if len(batch) == BATCH_SIZE:
+                await db.events.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await db.events.insert_many(batch, ordered=False)
+    await ensure_indexes(db)
+
+
+async def measure(func, repeat):
+    """Return average duration of the coroutine function calls in milliseconds."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await func()
+    return (time.perf_counter() - started) * 1000 / repeat
@@ -0,0 +1,155 @@
+import importlib
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Least recently used cache which expires entries after ttl seconds.
+
+    Args:
+        maxsize (int): maximum number of entries
+        ttl (float): default time to live of entries in seconds
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return default
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._data.pop(key, None)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+class LocalBackend:
+    """
+    In-process backend of ResponseCache.
+
+    Shared backends, e.g. for a cache server, implement the same coroutines,
+    so all workers read entries and the generation of one store.
+
+    Args:
+        maxsize (int): maximum number of entries
+        ttl (float): default time to live of entries in seconds
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.generation = 0
+        self._data = TTLCache(maxsize, ttl)
+
+    async def get(self, key):
+        return self._data.get(key)
+
+    async def set(self, key, value, ttl=None):
+        self._data.set(key, value, ttl)
+
+    async def get_generation(self):
+        return self.generation
+
+    async def incr_generation(self):
+        self.generation += 1
+
+    def as_dict(self):
+        return {
+            "size": len(self._data),
+            "evictions": self._data.evictions,
+            "expirations": self._data.expirations,
+        }
+
+
+def load_backend(path, maxsize, ttl):
+    """
+    Create ResponseCache backend.
+
+    Args:
+        path (str): "module:name" of the backend class, LocalBackend if empty
+        maxsize (int): maximum number of entries
+        ttl (float): default time to live of entries in seconds
+    """
+    if not path:
+        return LocalBackend(maxsize, ttl)
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)(maxsize, ttl)
+
+
+class ResponseCache:
+    """
+    Cache of query results which is invalidated by writes.
+
+    Keys are prefixed with the generation of the backend, so incrementing the
+    generation invalidates all entries at once and stale entries are evicted
+    by LRU or TTL of the backend.
+
+    Args:
+        backend: LocalBackend or a shared backend with the same interface
+        ttl (float): time to live of entries in seconds, 0 disables cache
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_set(self, key, func):
+        """
+        Return cached value of the key or the result of the coroutine function.
+
+        Value is cached under the generation which was current before the
+        call, so a write during the call invalidates the value.
+        """
+        if self.ttl <= 0:
+            return await func()
+        key = f"{await self.backend.get_generation()}:{key}"
+        if (value := await self.backend.get(key)) is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await func()
+        await self.backend.set(key, value, self.ttl)
+        return value
+
+    async def invalidate(self):
+        if self.ttl > 0:
+            await self.backend.incr_generation()
+
+    def as_dict(self):
+        requests = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0,
+        }
+        if hasattr(self.backend, "as_dict"):
+            stats.update(self.backend.as_dict())
+        return stats
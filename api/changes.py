@@ -0,0 +1,202 @@
+import asyncio
+import math
+import uuid
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cache import TTLCache
+from geo import bbox_contains
+
+CHANGE_OPERATIONS = ("insert", "update", "replace", "delete")
+
+
+class SubscriberOverflow(Exception):
+    pass
+
+
+class Subscriber:
+    """
+    Buffer of the event changes which match the bounding box of a subscription.
+
+    Pending changes are coalesced by event id, so a slow consumer receives
+    the latest state of every changed event. The subscription fails when more
+    than maxsize events are pending, so one slow consumer never holds changes
+    of the feed.
+
+    Args:
+        bbox (dict): west, south, east and north of the bounding box
+        event_types (list): event types of the subscription, all types if None
+        maxsize (int): maximum number of pending events
+    """
+
+    def __init__(self, bbox, event_types=None, maxsize=100):
+        self.bbox = bbox
+        self.event_types = set(event_types) if event_types is not None else None
+        self.maxsize = maxsize
+        self._pending = OrderedDict()
+        self._ready = asyncio.Event()
+        self._error = None
+
+    def matches_type(self, event_type):
+        return self.event_types is None or event_type in self.event_types
+
+    def matches(self, longitude, latitude, event_type):
+        if not self.matches_type(event_type):
+            return False
+        return bbox_contains(**self.bbox, longitude=longitude, latitude=latitude)
+
+    def put(self, event_id, change):
+        self._pending.pop(event_id, None)
+        self._pending[event_id] = change
+        if len(self._pending) > self.maxsize:
+            self.fail(SubscriberOverflow("Subscriber does not keep up with changes."))
+        self._ready.set()
+
+    def fail(self, error):
+        self._error = error
+        self._ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._pending and self._error is None:
+            self._ready.clear()
+            await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        _, change = self._pending.popitem(last=False)
+        return change
+
+
+class ChangeFeed:
+    """
+    Change stream of the events collection which is shared by the subscribers.
+
+    The worker watches the collection with a single change stream while it
+    has subscribers and fans changes out in process. Deleted documents have no
+    full document in the change stream, so locations of the watched documents
+    are kept to match deletes and moves out of the bounding boxes.
+
+    Args:
+        collection: mongo motor events collection
+        subscriber_size (int): maximum number of pending events of a subscriber
+        cache_size (int): maximum number of kept document locations
+    """
+
+    def __init__(self, collection, subscriber_size=100, cache_size=100000):
+        self.collection = collection
+        self.subscriber_size = subscriber_size
+        self._locations = TTLCache(cache_size, math.inf)
+        self._subscribers = set()
+        self._resume_token = None
+        self._task = None
+
+    async def subscribe(self, bbox, event_types=None, window=None):
+        """
+        Yield changes of the events inside the bounding box.
+
+        Changes are dicts with operation, which is one of CHANGE_OPERATIONS,
+        id of the event and document, which is None for deletes.
+
+        Args:
+            bbox (dict): west, south, east and north of the bounding box
+            event_types (list): event types of the changes, all types if None
+            window (asyncio.Semaphore): released by the consumer for every
+                delivered change, so pending changes are buffered and
+                coalesced by the subscriber while the consumer is busy
+        """
+        subscriber = Subscriber(bbox, event_types, self.subscriber_size)
+        self._subscribers.add(subscriber)
+        self.start()
+        try:
+            while True:
+                if window is not None:
+                    await window.acquire()
+                yield await subscriber.__anext__()
+        finally:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self.stop()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # the next subscribers start from the current changes, not the missed ones,
+        # so the kept locations go stale
+        self._resume_token = None
+        self._locations.clear()
+
+    async def watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": list(CHANGE_OPERATIONS)}}}]
+        while True:
+            try:
+                async with self.collection.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                ) as stream:
+                    async for change in stream:
+                        self._resume_token = change["_id"]
+                        self.publish(change)
+            except OperationFailure as err:
+                # e.g. change streams are not supported by standalone servers or
+                # history of the resume token is lost
+                self._resume_token = None
+                for subscriber in self._subscribers:
+                    subscriber.fail(err)
+                return
+            except PyMongoError:
+                await asyncio.sleep(1)
+
+    def publish(self, change):
+        """
+        Put change of the change stream into buffers of matching subscribers.
+
+        Locations of the events which are not changed since the feed started
+        are unknown, so their deletes are put into buffers of all subscribers
+        of the event type, which drop the events they do not show. Their
+        updates outside of the bounding box are put without the document, so
+        the subscribers drop the event which may have left the box.
+        """
+        operation = change["operationType"]
+        key = change["documentKey"]["_id"]
+        previous = self._locations.get(key)
+        if operation == "delete":
+            self._locations.pop(key)
+            if previous is not None:
+                event_id = previous[0]
+            elif isinstance(key, uuid.UUID):
+                # events are stored with the event id as _id
+                event_id = key
+            else:
+                return
+            doc, current = None, None
+        else:
+            if (doc := change.get("fullDocument")) is None:
+                return
+            doc = {field: value for field, value in doc.items() if field != "_id"}
+            event_id, event_type = doc["id"], doc["event_type"]
+            longitude, latitude = doc["location"]["coordinates"]
+            current = (event_id, longitude, latitude, event_type)
+            self._locations.set(key, current)
+
+        item = {"operation": operation, "id": event_id, "document": doc}
+        for subscriber in self._subscribers:
+            if current is not None and subscriber.matches(*current[1:]):
+                subscriber.put(event_id, item)
+            elif previous is not None:
+                # events which leave the bounding box are delivered as well
+                if subscriber.matches(*previous[1:]):
+                    subscriber.put(event_id, item)
+            elif operation == "delete":
+                subscriber.put(event_id, item)
+            elif operation != "insert" and subscriber.matches_type(current[3]):
+                # the event may leave the bounding box of the subscriber
+                subscriber.put(event_id, {**item, "document": None})
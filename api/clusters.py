@@ -0,0 +1,181 @@
+import math
+import os
+
+from cache import TTLCache
+from geo import bbox_filter, validate_bbox
+
+CLUSTERS_GRID_SIZE = int(os.getenv("CLUSTERS_GRID_SIZE", 8))
+CLUSTERS_MAX_TILES = int(os.getenv("CLUSTERS_MAX_TILES", 64))
+CLUSTERS_CACHE_TTL = float(os.getenv("CLUSTERS_CACHE_TTL", 5))
+CLUSTERS_CACHE_SIZE = int(os.getenv("CLUSTERS_CACHE_SIZE", 10000))
+
+MAX_ZOOM = 24
+
+tiles_cache = TTLCache(CLUSTERS_CACHE_SIZE, CLUSTERS_CACHE_TTL)
+
+
+def get_tiles(west, south, east, north, zoom):
+    """
+    Return tiles which cover the bounding box.
+
+    World is split into square tiles of 360 / 2^zoom degrees, tiles are indexed
+    from the south west corner. Column indexes of the boxes which cross the
+    antimeridian continue after the last column, so tiles remain contiguous.
+
+    Returns:
+        list: pairs of column and row indexes
+    """
+    size = 360 / 2**zoom
+    columns = 2**zoom
+    rows = math.ceil(180 / size)
+    if east < west:
+        east += 360
+        columns *= 2
+    first_column = math.floor((west + 180) / size)
+    last_column = min(math.floor((east + 180) / size), columns - 1)
+    first_row = math.floor((south + 90) / size)
+    last_row = min(math.floor((north + 90) / size), rows - 1)
+    return [
+        (column, row)
+        for column in range(first_column, last_column + 1)
+        for row in range(first_row, last_row + 1)
+    ]
+
+
+async def aggregate_clusters(collection, tiles, zoom, event_types=None):
+    """
+    Aggregate events of the tiles into grid cells with a single query.
+
+    Args:
+        collection: mongo motor events collection
+        tiles (list): pairs of column and row indexes returned by get_tiles
+        zoom (int): zoom level of the map
+        event_types (tuple): event types of the clusters, all types if None
+
+    Returns:
+        dict: clusters of the tiles by tile column, which wraps around the world,
+            and row indexes
+    """
+    size = 360 / 2**zoom
+    cell_size = size / CLUSTERS_GRID_SIZE
+
+    columns = [column for column, _ in tiles]
+    rows = [row for _, row in tiles]
+    west = min(columns) * size - 180
+    east = (max(columns) + 1) * size - 180
+    south = min(rows) * size - 90
+    north = min((max(rows) + 1) * size - 90, 90)
+    if east - west >= 360:
+        west, east = -180, 180
+    elif west >= 180:
+        west, east = west - 360, east - 360
+    if east > 180:
+        east -= 360
+
+    match = bbox_filter(west, south, east, north)
+    if event_types is not None:
+        match = {"$and": [match, {"event_type": {"$in": list(event_types)}}]}
+
+    cell = {
+        "x": {"$floor": {"$divide": [{"$add": ["$longitude", 180]}, cell_size]}},
+        "y": {"$floor": {"$divide": [{"$add": ["$latitude", 90]}, cell_size]}},
+    }
+    pipeline = [
+        {"$match": match},
+        {
+            "$project": {
+                "_id": 0,
+                "event_type": 1,
+                "longitude": {"$arrayElemAt": ["$location.coordinates", 0]},
+                "latitude": {"$arrayElemAt": ["$location.coordinates", 1]},
+            }
+        },
+        {
+            "$group": {
+                "_id": {**cell, "event_type": "$event_type"},
+                "count": {"$sum": 1},
+                "longitude": {"$sum": "$longitude"},
+                "latitude": {"$sum": "$latitude"},
+            }
+        },
+        {
+            "$group": {
+                "_id": {"x": "$_id.x", "y": "$_id.y"},
+                "count": {"$sum": "$count"},
+                "longitude": {"$sum": "$longitude"},
+                "latitude": {"$sum": "$latitude"},
+                "event_types": {
+                    "$push": {"event_type": "$_id.event_type", "count": "$count"}
+                },
+            }
+        },
+    ]
+
+    clusters = {}
+    async for doc in collection.aggregate(pipeline):
+        x, y = int(doc["_id"]["x"]), int(doc["_id"]["y"])
+        tile = (x // CLUSTERS_GRID_SIZE % 2**zoom, y // CLUSTERS_GRID_SIZE)
+        clusters.setdefault(tile, []).append(
+            {
+                "id": f"{zoom}/{x}/{y}",
+                "count": doc["count"],
+                "longitude": doc["longitude"] / doc["count"],
+                "latitude": doc["latitude"] / doc["count"],
+                "event_types": sorted(
+                    doc["event_types"], key=lambda itm: itm["count"], reverse=True
+                ),
+            }
+        )
+    return clusters
+
+
+async def get_clusters(collection, west, south, east, north, zoom, event_types=None):
+    """
+    Return event clusters of the tiles which cover the bounding box.
+
+    Clusters of every tile are cached for CLUSTERS_CACHE_TTL seconds, so users
+    who look at the same area share the aggregation result.
+
+    Args:
+        collection: mongo motor events collection
+        west (float): minimum longitude
+        south (float): minimum latitude
+        east (float): maximum longitude
+        north (float): maximum latitude
+        zoom (int): zoom level of the map
+        event_types (list): event types of the clusters, all types if None
+
+    Returns:
+        list: clusters with count, centroid and count of every event type
+    """
+    validate_bbox(west, south, east, north)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise Exception(f"Zoom must be within [0, {MAX_ZOOM}].")
+
+    tiles = get_tiles(west, south, east, north, zoom)
+    if len(tiles) > CLUSTERS_MAX_TILES:
+        raise Exception("Bounding box is too large for the zoom level.")
+
+    if event_types is not None:
+        event_types = tuple(sorted(set(event_types)))
+
+    clusters, missing = {}, []
+    for column, row in tiles:
+        tile = (column % 2**zoom, row)
+        cached = None
+        if CLUSTERS_CACHE_TTL > 0:
+            cached = tiles_cache.get((zoom, tile, event_types))
+        if cached is None:
+            missing.append((column, row))
+        else:
+            clusters[tile] = cached
+
+    if missing:
+        aggregated = await aggregate_clusters(collection, missing, zoom, event_types)
+        for column, row in missing:
+            tile = (column % 2**zoom, row)
+            clusters[tile] = aggregated.get(tile, [])
+            if CLUSTERS_CACHE_TTL > 0:
+                tiles_cache.set((zoom, tile, event_types), clusters[tile])
+
+    return [cluster for tile_clusters in clusters.values() for cluster in tile_clusters]
@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel, monitoring
+from pymongo.errors import OperationFailure
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener which collects statistics for pool sizing.
+
+    Checkout events are emitted by the thread which performs the checkout,
+    so wait time is measured with a thread local start mark.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _mark_wait(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return
+        wait_time = time.monotonic() - started
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failed_checkouts += 1
+            self._mark_wait()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self._mark_wait()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def as_dict(self):
+        with self._lock:
+            attempts = self.checkouts + self.failed_checkouts
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "idle": self.open - self.checked_out,
+                "checkouts": self.checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "wait_time_ms": {
+                    "avg": self.wait_time_total * 1000 / attempts if attempts else 0,
+                    "max": self.wait_time_max * 1000,
+                },
+            }
+
+
+def create_client(host, port, pool_stats=None, **options):
+    """
+    Create mongo motor client which is shared by all requests of the worker.
+
+    Args:
+        host (str): database host
+        port (int): database port
+        pool_stats (PoolStats): listener which collects connection pool statistics
+        options: pymongo client options, e.g. maxPoolSize or readPreference
+
+    Returns:
+        AsyncIOMotorClient: mongo motor client
+    """
+    event_listeners = [pool_stats] if pool_stats is not None else []
+    return AsyncIOMotorClient(
+        host,
+        port,
+        uuidRepresentation="standard",
+        event_listeners=event_listeners,
+        **options,
+    )
+
+
+EVENTS_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id", unique=True),
+    IndexModel(
+        [("changed_date", DESCENDING), ("id", DESCENDING)], name="changed_date_id"
+    ),
+    IndexModel(
+        [("address", TEXT), ("description", TEXT)], name="address_description_text"
+    ),
+    IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+]
+
+
+def index_key(info):
+    """
+    Key of the index as it is declared, text indexes are keyed by weights.
+
+    Args:
+        info (dict): index document of index_information or IndexModel
+
+    Returns:
+        tuple: pairs of field and direction
+    """
+    if "weights" in info:
+        return tuple(sorted((field, TEXT) for field in info["weights"]))
+    key = tuple(info["key"].items() if isinstance(info["key"], dict) else info["key"])
+    if any(direction == TEXT for _, direction in key):
+        return tuple(sorted((field, TEXT) for field, _ in key))
+    return key
+
+
+def index_options(info):
+    return bool(info.get("unique", False)), bool(info.get("sparse", False))
+
+
+# code of the error of a missing index
+INDEX_NOT_FOUND = 27
+
+logger = logging.getLogger(__name__)
+
+
+async def drop_index(collection, name):
+    """Drop index of the collection, which may be dropped by another worker."""
+    try:
+        await collection.drop_index(name)
+    except OperationFailure as err:
+        if err.code != INDEX_NOT_FOUND:
+            raise
+
+
+def log_index_failure(task):
+    """Log failure of the background index build task."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Index build failed", exc_info=task.exception())
+
+
+async def reconcile_indexes(collection, indexes, background=False):
+    """
+    Create declared indexes of the collection which do not exist yet.
+
+    Existing indexes with the declared name or key and other options are
+    dropped and built again, undeclared indexes are kept, so calling it on
+    every startup is cheap once indexes are built.
+
+    Args:
+        collection (AsyncIOMotorCollection): indexed collection
+        indexes (list): declared IndexModel of the collection
+        background (bool): build indexes without blocking the collection
+
+    Returns:
+        list: names of built indexes
+    """
+    existing = await collection.index_information()
+    missing = []
+    for index in indexes:
+        document = index.document
+        name, key = document["name"], index_key(document)
+        info = existing.get(name)
+        if (
+            info is not None
+            and index_key(info) == key
+            and index_options(info) == index_options(document)
+        ):
+            continue
+        for existing_name, info in existing.items():
+            if existing_name == name or index_key(info) == key:
+                await drop_index(collection, existing_name)
+        options = {
+            option: value for option, value in document.items() if option != "key"
+        }
+        if background:
+            options["background"] = True
+        missing.append(IndexModel(list(document["key"].items()), **options))
+    if missing:
+        await collection.create_indexes(missing)
+    return [index.document["name"] for index in missing]
+
+
+async def ensure_indexes(db, background=False):
+    """
+    Reconcile indexes required by the events queries.
+
+    Args:
+        db (AsyncIOMotorDatabase): events database
+        background (bool): build indexes without blocking the collection
+
+    Returns:
+        list: names of built indexes
+    """
+    return await reconcile_indexes(db.events, EVENTS_INDEXES, background)
+
+
+def collection_scans(explain):
+    """
+    Find collection scans in winning plans of the explain output.
+
+    Args:
+        explain (dict): output of find or aggregate explain
+
+    Returns:
+        list: COLLSCAN stages of the winning plans
+    """
+    scans = []
+
+    def walk(value, winning):
+        if isinstance(value, dict):
+            if winning and value.get("stage") == "COLLSCAN":
+                scans.append(value)
+            for key, item in value.items():
+                if key != "rejectedPlans":
+                    walk(item, winning or key == "winningPlan")
+        elif isinstance(value, list):
+            for item in value:
+                walk(item, winning)
+
+    walk(explain, False)
+    return scans
+
+
+async def check_indexes(db):
+    """
+    Explain canonical events queries and fail if any of them scans the collection.
+
+    Args:
+        db (AsyncIOMotorDatabase): events database
+    """
+    queries = {
+        "event by id": db.events.find({"id": uuid.UUID(int=0)}),
+        "events by changed date": db.events.find().sort(
+            [("changed_date", DESCENDING), ("id", DESCENDING)]
+        ),
+        "events search": db.events.find({"$text": {"$search": "crosswalk"}}),
+        "events near": db.events.find(
+            {
+                "location": {
+                    "$near": {"$geometry": {"type": "Point", "coordinates": [0, 0]}}
+                }
+            }
+        ),
+    }
+    failed = [
+        name
+        for name, cursor in queries.items()
+        if collection_scans(await cursor.explain())
+    ]
+    if failed:
+        raise Exception(f"Queries scan the events collection: {', '.join(failed)}")
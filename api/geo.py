@@ -0,0 +1,156 @@
+import math
+
+# mongo assumes spherical earth with the radius in meters for spherical queries
+EARTH_RADIUS = 6378100
+
+# wider boxes are split, so great circle edges stay close to the map viewport
+MAX_POLYGON_WIDTH = 90
+
+
+def covering_latitude(latitude, width):
+    """
+    Return latitude of the great circle edge which stays equatorward of latitude.
+
+    Great circle between two points on the same latitude bends towards the pole,
+    so the edge is moved to the equator to cover the whole box.
+
+    Args:
+        latitude (float): latitude of the box edge
+        width (float): longitude width of the edge
+    """
+    tangent = math.tan(math.radians(latitude)) * math.cos(math.radians(width / 2))
+    return math.degrees(math.atan(tangent))
+
+
+def bbox_to_geometry(west, south, east, north):
+    """
+    Return GeoJSON geometry which covers the bounding box.
+
+    Boxes which cross the antimeridian have west greater than east. Geometry
+    edges are great circles, so it may contain points around the box as well.
+
+    Args:
+        west (float): minimum longitude
+        south (float): minimum latitude
+        east (float): maximum longitude
+        north (float): maximum latitude
+
+    Returns:
+        dict: GeoJSON Polygon or MultiPolygon
+    """
+    ranges = [(west, east)] if west <= east else [(west, 180), (-180, east)]
+    polygons = []
+    for left, right in ranges:
+        if right <= left and len(ranges) > 1:
+            continue
+        parts = max(math.ceil((right - left) / MAX_POLYGON_WIDTH), 1)
+        step = (right - left) / parts
+        for idx in range(parts):
+            start, end = left + step * idx, left + step * (idx + 1)
+            bottom = covering_latitude(south, step) if south > 0 else south
+            top = covering_latitude(north, step) if north < 0 else north
+            ring = [[start, bottom], [end, bottom], [end, top], [start, top]]
+            polygons.append([ring + ring[:1]])
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def bbox_filter(west, south, east, north, field="location"):
+    """
+    Return mongo filter of the points inside the bounding box.
+
+    The 2dsphere index narrows documents with the covering geometry and
+    coordinates are compared to the box bounds afterwards.
+
+    Args:
+        west (float): minimum longitude
+        south (float): minimum latitude
+        east (float): maximum longitude
+        north (float): maximum latitude
+        field (str): GeoJSON point field
+    """
+    longitude, latitude = f"{field}.coordinates.0", f"{field}.coordinates.1"
+    if west <= east:
+        longitude_filter = {longitude: {"$gte": west, "$lte": east}}
+    else:
+        longitude_filter = {
+            "$or": [{longitude: {"$gte": west}}, {longitude: {"$lte": east}}]
+        }
+    geometry = bbox_to_geometry(west, south, east, north)
+    return {
+        "$and": [
+            {field: {"$geoWithin": {"$geometry": geometry}}},
+            longitude_filter,
+            {latitude: {"$gte": south, "$lte": north}},
+        ]
+    }
+
+
+def bbox_contains(west, south, east, north, longitude, latitude):
+    """Return true if the point is inside the bounding box."""
+    if not south <= latitude <= north:
+        return False
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+
+def validate_bbox(west, south, east, north):
+    """Raise exception if the bounding box coordinates are out of range."""
+    if not -90 <= south <= north <= 90:
+        raise Exception("Bounding box latitudes must be ordered within [-90, 90].")
+    if not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise Exception("Bounding box longitudes must be within [-180, 180].")
+
+
+def geo_near_stage(longitude, latitude, max_distance=None, query=None):
+    """
+    Return $geoNear aggregation stage which adds distance field in meters.
+
+    Args:
+        longitude (float): longitude of the point
+        latitude (float): latitude of the point
+        max_distance (float): maximum distance in meters
+        query (dict): filter of the documents
+    """
+    stage = {
+        "near": {"type": "Point", "coordinates": [longitude, latitude]},
+        "distanceField": "distance",
+        "spherical": True,
+    }
+    if max_distance is not None:
+        stage["maxDistance"] = max_distance
+    if query:
+        stage["query"] = query
+    return {"$geoNear": stage}
+
+
+def center_sphere(longitude, latitude, max_distance):
+    """Return $centerSphere shape of the circle with radius in meters."""
+    return {"$centerSphere": [[longitude, latitude], max_distance / EARTH_RADIUS]}
+
+
+def distance_expression(longitude, latitude, field="$location.coordinates"):
+    """
+    Return aggregation expression of haversine distance in meters to the point.
+
+    It is used where $geoNear can not be, e.g. along with $text search.
+    """
+    lng = {"$degreesToRadians": {"$arrayElemAt": [field, 0]}}
+    lat = {"$degreesToRadians": {"$arrayElemAt": [field, 1]}}
+    d_lng = {"$subtract": [lng, math.radians(longitude)]}
+    d_lat = {"$subtract": [lat, math.radians(latitude)]}
+    a = {
+        "$add": [
+            {"$pow": [{"$sin": {"$divide": [d_lat, 2]}}, 2]},
+            {
+                "$multiply": [
+                    math.cos(math.radians(latitude)),
+                    {"$cos": lat},
+                    {"$pow": [{"$sin": {"$divide": [d_lng, 2]}}, 2]},
+                ]
+            },
+        ]
+    }
+    return {"$multiply": [2 * EARTH_RADIUS, {"$asin": {"$sqrt": a}}]}
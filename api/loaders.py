@@ -0,0 +1,101 @@
+import asyncio
+from functools import partial
+
+from queries import get_event_projection
+
+
+class DataLoader:
+    """
+    Asyncio data loader which batches keys requested within one event loop tick.
+
+    Repeated keys are resolved with the same future, so every key is requested
+    once per loader, i.e. once per request.
+
+    Args:
+        batch_load_fn: coroutine function which takes list of keys and returns
+            dict of values by key, missing keys are resolved with None
+    """
+
+    def __init__(self, batch_load_fn):
+        self.batch_load_fn = batch_load_fn
+        self._futures = {}
+        self._queue = []
+        self._task = None
+
+    def load(self, key):
+        if (future := self._futures.get(key)) is not None:
+            return future
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._futures[key] = future
+        self._queue.append((key, future))
+        if len(self._queue) == 1:
+            # other resolvers of the tick enqueue their keys before the dispatch
+            loop.call_soon(self.schedule_dispatch)
+        return future
+
+    def load_many(self, keys):
+        return asyncio.gather(*(self.load(key) for key in keys))
+
+    def prime(self, key, value):
+        """Replace value of the key, e.g. by the value written with a mutation."""
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(value)
+        self._futures[key] = future
+
+    def clear(self, key):
+        self._futures.pop(key, None)
+
+    def schedule_dispatch(self):
+        self._task = asyncio.ensure_future(self.dispatch())
+
+    async def dispatch(self):
+        queue, self._queue = self._queue, []
+        try:
+            values = await self.batch_load_fn([key for key, _ in queue])
+        except Exception as err:
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for key, future in queue:
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+class Loaders:
+    """
+    Data loaders of the request.
+
+    Args:
+        db (AsyncIOMotorDatabase): events database
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._events = {}
+
+    def event(self, fields=None):
+        """
+        Return loader of the events with projection of the fields.
+
+        Args:
+            fields (set): names of Event fields to load, all fields if None
+        """
+        projection = get_event_projection(fields)
+        key = frozenset(projection)
+        if (loader := self._events.get(key)) is None:
+            loader = DataLoader(partial(self.load_events, projection))
+            self._events[key] = loader
+        return loader
+
+    def clear_event(self, id):
+        for loader in self._events.values():
+            loader.clear(id)
+
+    async def load_events(self, projection, ids):
+        cursor = self.db.events.aggregate(
+            [{"$match": {"id": {"$in": ids}}}, {"$project": projection}]
+        )
+        return {doc["id"]: doc async for doc in cursor}
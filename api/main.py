@@ -1,26 +1,65 @@
+import asyncio
+import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, tzinfo
 
 import graphene
+import pytz
 from fastapi import Cookie, Depends, FastAPI, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from graphql.execution.executors.asyncio import AsyncioExecutor
 from jose import JWTError, jwt
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from starlette import status
-from starlette.graphql import GraphQLApp
+from starlette.background import BackgroundTasks
+from starlette.graphql import format_graphql_error
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocket
 
+from auth import TokenCache
+from changes import ChangeFeed
+from database import (
+    PoolStats,
+    check_indexes,
+    create_client,
+    ensure_indexes,
+    log_index_failure,
+)
+from loaders import Loaders
 from mutations import Mutation
-from queries import Query
+from persisted import PersistedQueryBackend, PersistedQueryError, load_allowlist
+from queries import Query, events_cache
+from subscriptions import Subscription, serve_subscriptions
 
 AUTH_EXPIRATION_MINUTES = os.getenv("AUTH_EXPIRATION_MINUTES", 60)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 300))
 DEBUG = os.getenv("DEBUG", "True").lower() == "true"
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
 DATABASE_PORT = os.getenv("DATABASE_PORT", 27017)
 DATABASE_NAME = os.getenv("DATABASE_NAME", "crosswalk")
+DATABASE_MAX_POOL_SIZE = os.getenv("DATABASE_MAX_POOL_SIZE", 100)
+DATABASE_MIN_POOL_SIZE = os.getenv("DATABASE_MIN_POOL_SIZE", 0)
+DATABASE_MAX_IDLE_TIME_MS = os.getenv("DATABASE_MAX_IDLE_TIME_MS")
+DATABASE_WAIT_QUEUE_TIMEOUT_MS = os.getenv("DATABASE_WAIT_QUEUE_TIMEOUT_MS")
+DATABASE_CONNECT_TIMEOUT_MS = os.getenv("DATABASE_CONNECT_TIMEOUT_MS", 20000)
+DATABASE_SOCKET_TIMEOUT_MS = os.getenv("DATABASE_SOCKET_TIMEOUT_MS")
+DATABASE_SERVER_SELECTION_TIMEOUT_MS = os.getenv(
+    "DATABASE_SERVER_SELECTION_TIMEOUT_MS", 30000
+)
+DATABASE_READ_PREFERENCE = os.getenv("DATABASE_READ_PREFERENCE", "primary")
+DATABASE_INDEXES_BACKGROUND = (
+    os.getenv("DATABASE_INDEXES_BACKGROUND", "False").lower() == "true"
+)
+DATABASE_INDEXES_CHECK = os.getenv("DATABASE_INDEXES_CHECK", "False").lower() == "true"
+PERSISTED_QUERIES_CACHE_SIZE = int(os.getenv("PERSISTED_QUERIES_CACHE_SIZE", 1000))
+PERSISTED_QUERIES_ALLOWLIST = os.getenv("PERSISTED_QUERIES_ALLOWLIST")
+GRAPHQL_MAX_BATCH_SIZE = int(os.getenv("GRAPHQL_MAX_BATCH_SIZE", 10))
+SUBSCRIPTIONS_BUFFER_SIZE = int(os.getenv("SUBSCRIPTIONS_BUFFER_SIZE", 100))
+SUBSCRIPTIONS_WINDOW_SIZE = int(os.getenv("SUBSCRIPTIONS_WINDOW_SIZE", 10))
 
 ORIGINS = ["*"]
 
@@ -29,41 +68,98 @@ app = FastAPI()
 
 security = HTTPBearer()
 
+client: AsyncIOMotorClient = None
 
-async def get_current_user_creadentials(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-):
+pool_stats = PoolStats()
+
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+change_feed: ChangeFeed = None
+indexes_task: asyncio.Task = None
+
+
+def authenticate(token):
+    """Return credentials of the verified token or raise 401 HTTPException."""
+    if (user := token_cache.get(token)) is not None:
+        return user
     try:
-        data = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=["HS256"])
+        data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         if datetime.fromtimestamp(data["exp"]) <= datetime.now():
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Token is expired"
             )
-        return {"id": data["id"], "username": data["username"]}
     except JWTError as err:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(err))
+    user = {"id": data["id"], "username": data["username"]}
+    token_cache.set(token, user, data["exp"])
+    return user
 
 
-async def get_db():
-    client = AsyncIOMotorClient(
-        DATABASE_HOST, DATABASE_PORT, uuidRepresentation="standard"
+async def get_current_user_creadentials(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    return authenticate(credentials.credentials)
+
+
+async def setup_indexes(db):
+    """
+    Reconcile indexes of the database and check the queries use them.
+
+    Indexes are built by the background task when DATABASE_INDEXES_BACKGROUND
+    is set and the check is off, so the worker starts serving requests while
+    indexes of a large collection are built.
+    """
+    global indexes_task
+    if DATABASE_INDEXES_BACKGROUND and not DATABASE_INDEXES_CHECK:
+        indexes_task = asyncio.ensure_future(ensure_indexes(db, background=True))
+        indexes_task.add_done_callback(log_index_failure)
+        return
+    await ensure_indexes(db, background=DATABASE_INDEXES_BACKGROUND)
+    if DATABASE_INDEXES_CHECK:
+        await check_indexes(db)
+
+
+@app.on_event("startup")
+async def startup():
+    global client
+    client = create_client(
+        DATABASE_HOST,
+        DATABASE_PORT,
+        pool_stats=pool_stats,
+        maxPoolSize=DATABASE_MAX_POOL_SIZE,
+        minPoolSize=DATABASE_MIN_POOL_SIZE,
+        maxIdleTimeMS=DATABASE_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=DATABASE_WAIT_QUEUE_TIMEOUT_MS,
+        connectTimeoutMS=DATABASE_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=DATABASE_SOCKET_TIMEOUT_MS,
+        serverSelectionTimeoutMS=DATABASE_SERVER_SELECTION_TIMEOUT_MS,
+        readPreference=DATABASE_READ_PREFERENCE,
     )
-    yield client[DATABASE_NAME]
+    await setup_indexes(client[DATABASE_NAME])
+    global change_feed
+    change_feed = ChangeFeed(
+        client[DATABASE_NAME].events, subscriber_size=SUBSCRIPTIONS_BUFFER_SIZE
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    change_feed.stop()
     client.close()
 
 
-async def database_middleware(next, root, info, **args):
-    if "db" not in info.context:
-        info.context["db"] = info.context["request"].db
-    return next(root, info, **args)
+async def get_timezone(timezone: str = Cookie("UTC")):
+    try:
+        return pytz.timezone(timezone)
+    except pytz.UnknownTimeZoneError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Timezone {timezone} is not valid",
+        )
 
 
-async def user_info_middleware(next, root, info, **args):
-    if "credentials" not in info.context:
-        info.context["credentials"] = info.context["request"].credentials
-    if "timezone" not in info.context:
-        info.context["timezone"] = info.context["request"].timezone
-    return next(root, info, **args)
+async def get_db():
+    return client[DATABASE_NAME]
 
 
 class MiddlewareSchema(graphene.Schema):
@@ -88,24 +184,146 @@ app.add_middleware(
 schema = MiddlewareSchema(
     query=Query,
     mutation=Mutation,
-    middleware=[database_middleware, user_info_middleware],
+    subscription=Subscription,
+)
+
+
+persisted_queries = PersistedQueryBackend(
+    maxsize=PERSISTED_QUERIES_CACHE_SIZE,
+    allowlist=(
+        load_allowlist(PERSISTED_QUERIES_ALLOWLIST)
+        if PERSISTED_QUERIES_ALLOWLIST
+        else None
+    ),
 )
 
 
-graphql_app = GraphQLApp(schema=schema, executor_class=AsyncioExecutor)
+async def execute_operation(data, context, executor):
+    """
+    Execute GraphQL operation request.
+
+    Args:
+        data (dict): operation request with query or persisted query hash
+        context (dict): execution context which is shared by the batch operations
+        executor (AsyncioExecutor): executor of the request
+
+    Returns:
+        dict: operation result with data and errors
+    """
+    if not isinstance(data, dict):
+        return {"errors": [{"message": "Operation must be a JSON object."}]}
+    try:
+        query = persisted_queries.resolve_query(schema, data)
+    except PersistedQueryError as err:
+        return {"errors": [err.as_dict()]}
+
+    result = await schema.execute(
+        query,
+        variables=data.get("variables"),
+        operation_name=data.get("operationName"),
+        context=context,
+        executor=executor,
+        return_promise=True,
+        backend=persisted_queries,
+    )
+    response_data = {"data": result.data}
+    if result.errors:
+        response_data["errors"] = [format_graphql_error(err) for err in result.errors]
+    return response_data
+
+
+def parse_json(value, name):
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{name} is not valid JSON",
+        )
+
+
+async def get_operation_data(request: Request):
+    """
+    Read operation request of the JSON or application/graphql body or query string.
+
+    Returns:
+        dict or list: operation request or batch of operation requests
+    """
+    content_type = request.headers.get("Content-Type", "")
+    if "application/json" in content_type:
+        return parse_json(await request.body(), "Request body")
+    if "application/graphql" in content_type:
+        return {"query": (await request.body()).decode()}
+    if "query" in request.query_params or "extensions" in request.query_params:
+        data = dict(request.query_params)
+        for name in ("variables", "extensions"):
+            if data.get(name):
+                data[name] = parse_json(data[name], name.capitalize())
+        return data
+    raise HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail="Unsupported Media Type",
+    )
 
 
 @app.post("/")
 async def main(
     request: Request,
-    timezone: str = Cookie("UTC"),
+    timezone: tzinfo = Depends(get_timezone),
     credentials: dict = Depends(get_current_user_creadentials),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    request.db = db
-    request.timezone = timezone
-    request.credentials = credentials
-    return await graphql_app.handle_graphql(request)
+    data = await get_operation_data(request)
+    background = BackgroundTasks()
+    # context is built once, resolvers read it without per-field middleware
+    context = {
+        "request": request,
+        "background": background,
+        "db": db,
+        "loaders": Loaders(db),
+        "credentials": credentials,
+        "timezone": timezone,
+    }
+    executor = AsyncioExecutor()
+
+    if not isinstance(data, list):
+        response_data = await execute_operation(data, context, executor)
+        # persisted query errors are not execution errors, clients expect 200
+        status_code = status.HTTP_200_OK
+        if "data" in response_data and "errors" in response_data:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return JSONResponse(
+            response_data, status_code=status_code, background=background
+        )
+
+    if not 0 < len(data) <= GRAPHQL_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch must have from 1 to {GRAPHQL_MAX_BATCH_SIZE} operations",
+        )
+    # operations share the request context, so loaders batch their lookups too
+    results = await asyncio.gather(
+        *(execute_operation(operation, context, executor) for operation in data)
+    )
+    return JSONResponse(results, background=background)
+
+
+@app.websocket("/subscriptions")
+async def subscriptions(websocket: WebSocket):
+    try:
+        timezone = await get_timezone(websocket.cookies.get("timezone", "UTC"))
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    context = {"db": await get_db(), "timezone": timezone, "changes": change_feed}
+    await serve_subscriptions(
+        websocket,
+        schema,
+        authenticate,
+        context,
+        backend=persisted_queries,
+        window_size=SUBSCRIPTIONS_WINDOW_SIZE,
+    )
 
 
 @app.post("/token")
@@ -118,3 +336,12 @@ async def get_token():
         "exp": datetime.now() + timedelta(minutes=AUTH_EXPIRATION_MINUTES),
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "pool": pool_stats.as_dict(),
+        "tokens": token_cache.as_dict(),
+        "events": events_cache.as_dict(),
+    }
@@ -1,15 +1,24 @@
+import asyncio
+import os
 import uuid
 from datetime import datetime
 
 import graphene
 from graphene import relay
 from graphql_relay import from_global_id
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 
-from queries import Event, EventType
+from pagination import localize_datetimes
+from queries import Event, EventType, events_cache, get_event_projection
+from selections import get_selected_fields
 
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", 1000))
 
-def get_event_from_document(doc):
+
+def get_event_from_document(doc, timezone=None):
     longitude, latitude = doc["location"]["coordinates"]
+    doc = localize_datetimes(doc, timezone)
     return Event(
         **{field: value for field, value in doc.items() if field != "location"},
         longitude=longitude,
@@ -17,6 +26,60 @@ def get_event_from_document(doc):
     )
 
 
+def get_current_date():
+    """
+    Return current datetime as it is stored, MongoDB keeps only milliseconds.
+
+    Returned changed date of the event is sent back as the expected one, so
+    it must be equal to the stored date.
+    """
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def get_event_document(input, credentials, current_date):
+    """
+    Return new event document of the create mutation input.
+
+    Args:
+        input (dict): event_type, description, address and coordinates
+        credentials (dict): user who creates the event
+        current_date (datetime): created date of the event
+    """
+    if not input["address"]:
+        raise Exception("Address value cannot be empty string")
+    if not -180 <= input["longitude"] <= 180 or not -90 <= input["latitude"] <= 90:
+        raise Exception("Coordinates are out of range")
+    return {
+        "id": uuid.uuid4(),
+        "event_type": input["event_type"],
+        "description": input.get("description"),
+        "address": input["address"],
+        "location": {
+            "type": "Point",
+            "coordinates": [input["longitude"], input["latitude"]],
+        },
+        "created_by": credentials,
+        "created_date": current_date,
+        "changed_date": current_date,
+    }
+
+
+def to_stored_document(doc):
+    """
+    Return event document keyed by the event id.
+
+    Change stream deletes carry only the _id of the document, so the change
+    feed reads the id of deleted events from it.
+    """
+    return {"_id": doc["id"], **doc}
+
+
+def chunks(items, size):
+    for idx in range(0, len(items), size):
+        yield items[idx : idx + size]
+
+
 class CreateEventMutation(relay.ClientIDMutation):
     class Input:
         event_type = graphene.Field(type=EventType, required=True)
@@ -30,26 +93,93 @@ class CreateEventMutation(relay.ClientIDMutation):
 
     @staticmethod
     async def mutate_and_get_payload(root, info, **input):
-        current_date = datetime.now()
+        doc = get_event_document(input, info.context["credentials"], get_current_date())
+        collection = info.context["db"].events
+        await collection.insert_one(to_stored_document(doc))
+        await events_cache.invalidate()
+        return get_event_from_document(doc, info.context["timezone"])
+
+
+class EventInput(graphene.InputObjectType):
+    event_type = EventType(required=True)
+    description = graphene.String()
+
+    address = graphene.String(required=True)
+    longitude = graphene.Float(required=True)
+    latitude = graphene.Float(required=True)
+
+
+class EventResult(graphene.ObjectType):
+    event = graphene.Field(Event)
+    error = graphene.String()
+
+
+class CreateEventsMutation(relay.ClientIDMutation):
+    class Input:
+        inputs = graphene.List(graphene.NonNull(EventInput), required=True)
+
+    results = graphene.List(
+        graphene.NonNull(EventResult), description="Results in the order of inputs."
+    )
+
+    @staticmethod
+    async def mutate_and_get_payload(root, info, **input):
         credentials = info.context["credentials"]
-        if not input["address"]:
-            raise Exception("Address value cannot be empty string")
-        doc = {
-            "id": uuid.uuid4(),
-            "event_type": input["event_type"],
-            "description": input.get("description"),
-            "address": input["address"],
-            "location": {
-                "type": "Point",
-                "coordinates": [input["longitude"], input["latitude"]],
-            },
-            "created_by": credentials,
-            "created_date": current_date,
-            "changed_date": current_date,
-        }
+        current_date = get_current_date()
         collection = info.context["db"].events
-        await collection.insert_one(doc.copy())
-        return get_event_from_document(doc)
+
+        results = [None] * len(input["inputs"])
+        docs = []
+        for idx, event_input in enumerate(input["inputs"]):
+            try:
+                docs.append(
+                    (idx, get_event_document(event_input, credentials, current_date))
+                )
+            except Exception as err:
+                results[idx] = EventResult(error=str(err))
+
+        for chunk in chunks(docs, EVENTS_BATCH_SIZE):
+            errors = {}
+            try:
+                await collection.insert_many(
+                    [to_stored_document(doc) for _, doc in chunk], ordered=False
+                )
+            except BulkWriteError as err:
+                errors = {
+                    error["index"]: error["errmsg"]
+                    for error in err.details["writeErrors"]
+                }
+            for chunk_idx, (idx, doc) in enumerate(chunk):
+                if chunk_idx in errors:
+                    results[idx] = EventResult(error=errors[chunk_idx])
+                else:
+                    event = get_event_from_document(doc, info.context["timezone"])
+                    results[idx] = EventResult(event=event)
+
+        await events_cache.invalidate()
+        return CreateEventsMutation(results=results)
+
+
+def to_stored_datetime(value):
+    """
+    Return naive datetime of milliseconds as it is stored, e.g. for the input value.
+
+    Args:
+        value (datetime): datetime of the input
+    """
+    value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+async def raise_event_not_modified(collection, event_id, expected_changed_date):
+    """Raise exception why the event filter of the mutation matched nothing."""
+    if expected_changed_date is not None and await collection.count_documents(
+        {"id": event_id}, limit=1
+    ):
+        raise Exception(f"Event with id {event_id} was changed by another request.")
+    raise Exception(f"Event with id {event_id} is not exist.")
 
 
 class UpdateEventMutation(relay.ClientIDMutation):
@@ -62,48 +192,129 @@ class UpdateEventMutation(relay.ClientIDMutation):
         longitude = graphene.Float()
         latitude = graphene.Float()
 
+        expected_changed_date = graphene.DateTime(
+            description="Event is updated only if it is not changed since then."
+        )
+
     Output = Event
 
     @staticmethod
     async def mutate_and_get_payload(root, info, **input):
         type, _id = from_global_id(input["id"])
+        event_id = uuid.UUID(_id)
         collection = info.context["db"].events
+        fields = get_selected_fields(info)
 
-        if doc := await collection.find_one({"id": uuid.UUID(_id)}, {"_id": 0}):
-            updated_document = dict(
-                doc,
-                **{
-                    key: input[key]
-                    for key in doc.keys()
-                    if input.get(key) and key != "id"
-                },
-                changed_date=datetime.now()
-            )
-            await collection.update_one({"id": uuid.UUID(_id)}, {"$set": updated_document.copy()})
-            return get_event_from_document(updated_document)
+        changes = {
+            key: input[key]
+            for key in ("event_type", "description", "address")
+            if input.get(key)
+        }
+        for idx, key in enumerate(("longitude", "latitude")):
+            if input.get(key) is not None:
+                changes[f"location.coordinates.{idx}"] = input[key]
+        changes["changed_date"] = get_current_date()
+
+        filter = {"id": event_id}
+        if (expected_changed_date := input.get("expected_changed_date")) is not None:
+            filter["changed_date"] = to_stored_datetime(expected_changed_date)
 
-        raise Exception(f"Event with id {_id} is not exist.")
+        doc = await collection.find_one_and_update(
+            filter,
+            {"$set": changes},
+            projection=get_event_projection(fields),
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            await raise_event_not_modified(collection, event_id, expected_changed_date)
+
+        await events_cache.invalidate()
+        info.context["loaders"].clear_event(event_id)
+        info.context["loaders"].event(fields).prime(event_id, doc)
+        return Event(**localize_datetimes(doc, info.context["timezone"]))
 
 
 class DeleteEventMutation(relay.ClientIDMutation):
     class Input:
         id = graphene.ID(required=True)
 
+        expected_changed_date = graphene.DateTime(
+            description="Event is deleted only if it is not changed since then."
+        )
+
     Output = Event
 
     @staticmethod
     async def mutate_and_get_payload(root, info, **input):
         type, _id = from_global_id(input["id"])
+        event_id = uuid.UUID(_id)
         collection = info.context["db"].events
+        fields = get_selected_fields(info)
+
+        filter = {"id": event_id}
+        if (expected_changed_date := input.get("expected_changed_date")) is not None:
+            filter["changed_date"] = to_stored_datetime(expected_changed_date)
 
-        if doc := await collection.find_one({"id": uuid.UUID(_id)}, {"_id": 0}):
-            await collection.delete_one({"id": uuid.UUID(_id)})
-            return get_event_from_document(doc)
+        doc = await collection.find_one_and_delete(
+            filter, projection=get_event_projection(fields)
+        )
+        if doc is None:
+            await raise_event_not_modified(collection, event_id, expected_changed_date)
+
+        await events_cache.invalidate()
+        info.context["loaders"].clear_event(event_id)
+        info.context["loaders"].event(fields).prime(event_id, None)
+        return Event(**localize_datetimes(doc, info.context["timezone"]))
+
+
+class DeleteEventsMutation(relay.ClientIDMutation):
+    class Input:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    results = graphene.List(
+        graphene.NonNull(EventResult), description="Results in the order of ids."
+    )
+
+    @staticmethod
+    async def mutate_and_get_payload(root, info, **input):
+        collection = info.context["db"].events
+        loaders = info.context["loaders"]
+        projection = get_event_projection(get_selected_fields(info, "results", "event"))
+
+        results = [None] * len(input["ids"])
+        event_ids = []
+        for idx, id in enumerate(input["ids"]):
+            try:
+                type, _id = from_global_id(id)
+                event_ids.append((idx, uuid.UUID(_id)))
+            except Exception:
+                results[idx] = EventResult(error=f"Id {id} is not valid.")
+
+        for chunk in chunks(event_ids, EVENTS_BATCH_SIZE):
+            # every event is reported as deleted only by the request which
+            # deleted it, unlike find and delete_many of concurrent requests
+            docs = await asyncio.gather(
+                *(
+                    collection.find_one_and_delete({"id": event_id}, projection)
+                    for _, event_id in chunk
+                )
+            )
+            for (idx, event_id), doc in zip(chunk, docs):
+                if doc is None:
+                    error = f"Event with id {event_id} is not exist."
+                    results[idx] = EventResult(error=error)
+                    continue
+                loaders.clear_event(event_id)
+                event = Event(**localize_datetimes(doc, info.context["timezone"]))
+                results[idx] = EventResult(event=event)
 
-        raise Exception(f"Event with id {_id} is not exist.")
+        await events_cache.invalidate()
+        return DeleteEventsMutation(results=results)
 
 
 class Mutation(graphene.ObjectType):
     create_event = CreateEventMutation.Field()
+    create_events = CreateEventsMutation.Field()
     update_event = UpdateEventMutation.Field()
     delete_event = DeleteEventMutation.Field()
+    delete_events = DeleteEventsMutation.Field()
@@ -1,38 +1,229 @@
+import base64
+import hashlib
+from datetime import datetime
+
+import bson
 import graphene
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions
 from graphene import relay
 from graphql_relay.connection.arrayconnection import (
     get_offset_with_default,
     offset_to_cursor,
 )
 
+CURSOR_CODEC_OPTIONS = CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+
+
+class Pagination(graphene.Enum):
+    OFFSET = 1
+    KEYSET = 2
 
-def limitskip(count, **kwargs):
+
+def limitskip(count=None, **kwargs):
     """
     Return limit/offest values for mongo cursor.
 
     Args:
+        count (int): count of documents, required for last without before only
         first (int): limit of documents in the query
         last (int): limit of documents in the query from the end of the collection
         after (str): skip of ducuments in the query, expects base64 string
         before (str): skip of documents in the query from the end, expects base64 string
+
+    Returns:
+        tuple: limit, which is None for unlimited query and 0 for empty page,
+            and skip values
     """
-    limit = count
+    end = count
     skip = get_offset_with_default(kwargs.get("after"))
 
     if before := kwargs.get("before"):
-        limit = get_offset_with_default(before) - 1
+        end = get_offset_with_default(before) - 1
 
+    limit = max(end - skip, 0) if end is not None else None
     if first := kwargs.get("first"):
-        limit = min(first, limit)
+        limit = min(first, limit) if limit is not None else first
     elif last := kwargs.get("last"):
-        skip = max(limit - last, skip)
+        skip = max(end - last, skip)
+        # after cursor past the before one selects nothing
+        limit = max(end - skip, 0)
 
     return limit, skip
 
 
+def keyset_to_cursor(sort, doc):
+    """
+    Return opaque cursor which holds document values of the sort fields.
+
+    Args:
+        sort (list): pairs of field and direction
+        doc (dict): mongo document
+    """
+    data = bson.encode(
+        {"keys": [doc[field] for field, _ in sort]},
+        codec_options=CURSOR_CODEC_OPTIONS,
+    )
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def cursor_to_keyset(sort, cursor):
+    """
+    Return values of the sort fields from the cursor.
+
+    Args:
+        sort (list): pairs of field and direction
+        cursor (str): cursor returned by keyset_to_cursor
+    """
+    try:
+        data = bson.decode(
+            base64.urlsafe_b64decode(cursor), codec_options=CURSOR_CODEC_OPTIONS
+        )
+        keys = data["keys"]
+    except Exception:
+        raise Exception(f"Cursor {cursor} is not valid.")
+    if len(keys) != len(sort):
+        raise Exception(f"Cursor {cursor} is not valid.")
+    return keys
+
+
+def keyset_filter(sort, keys, forward=True):
+    """
+    Return mongo filter which matches documents after the keyset.
+
+    Args:
+        sort (list): pairs of field and direction
+        keys (list): values of the sort fields
+        forward (bool): match documents after the keyset when true, else before it
+    """
+    predicates = []
+    for idx, (field, direction) in enumerate(sort):
+        operator = "$gt" if (direction > 0) == forward else "$lt"
+        predicate = {sort_field: key for (sort_field, _), key in zip(sort, keys[:idx])}
+        predicate[field] = {operator: keys[idx]}
+        predicates.append(predicate)
+    return {"$or": predicates}
+
+
+def localize_datetimes(doc, timezone):
+    """
+    Return copy of the document with datetime values converted to the timezone.
+
+    Args:
+        doc (dict): mongo document
+        timezone (tzinfo): timezone of the request, document is not copied if None
+    """
+    if timezone is None:
+        return doc
+    return {
+        field: value.astimezone(timezone) if isinstance(value, datetime) else value
+        for field, value in doc.items()
+    }
+
+
+class MotorQuery:
+    """
+    Aggregation query which is paginated by MotorConnectionField.
+
+    Args:
+        collection: mongo motor collection
+        pipeline (list): leading aggregation stages which filter documents
+        sort (list): pairs of field and direction, fields must identify a document
+        projection (dict): projection of the page documents
+        timezone (tzinfo): timezone of the page documents datetime values
+        cache (ResponseCache): cache of the counts and page documents
+    """
+
+    def __init__(
+        self,
+        collection,
+        pipeline=(),
+        sort=(),
+        projection=None,
+        timezone=None,
+        cache=None,
+    ):
+        self.collection = collection
+        self.pipeline = list(pipeline)
+        self.sort = list(sort)
+        self.projection = projection
+        self.timezone = timezone
+        self.cache = cache
+
+    def cache_key(self, *args):
+        """Return key of the query result, pipeline is built from arguments."""
+        data = bson.encode(
+            {"query": [self.pipeline, self.sort, self.projection, *args]},
+            codec_options=CURSOR_CODEC_OPTIONS,
+        )
+        return hashlib.sha256(data).hexdigest()
+
+    async def cached(self, func, *args):
+        if self.cache is None:
+            return await func(*args)
+        key = self.cache_key(func.__name__, *args)
+        return await self.cache.get_or_set(key, lambda: func(*args))
+
+    async def count(self, estimated=False):
+        """
+        Return count of the query documents.
+
+        Args:
+            estimated (bool): use collection metadata when the query has no filters
+        """
+        return await self.cached(self._count, estimated)
+
+    async def _count(self, estimated):
+        if estimated and not self.pipeline:
+            return await self.collection.estimated_document_count()
+        pipeline = [*self.pipeline, {"$count": "count"}]
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        return result[0]["count"] if result else 0
+
+    def aggregate(self, filters=(), sort=None, skip=0, limit=0):
+        """
+        Return mongo motor cursor of the query page documents.
+
+        Args:
+            filters (list): extra mongo filters of the page
+            sort (list): pairs of field and direction, defaults to the query sort
+            skip (int): number of skipped documents
+            limit (int): limit of documents
+        """
+        pipeline = [*self.pipeline, *({"$match": filter} for filter in filters)]
+        if sort := sort or self.sort:
+            pipeline.append({"$sort": dict(sort)})
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        if self.projection:
+            projection = dict(self.projection)
+            projection.update(
+                {field: 1 for field, _ in self.sort if field not in projection}
+            )
+            pipeline.append({"$project": projection})
+        return self.collection.aggregate(pipeline)
+
+    async def fetch(self, filters=(), sort=None, skip=0, limit=0):
+        """Return list of the page documents, arguments are the same as aggregate."""
+        docs = await self.cached(self._fetch, list(filters), sort, skip, limit)
+        return list(docs)
+
+    async def _fetch(self, filters, sort, skip, limit):
+        return await self.aggregate(filters, sort, skip, limit).to_list(None)
+
+
 class MotorConnectionField(relay.ConnectionField):
     """Mongo Motor relay ConnectionField implementation."""
 
+    def __init__(self, type, *args, **kwargs):
+        kwargs.setdefault(
+            "pagination",
+            graphene.Argument(Pagination, default_value=Pagination.KEYSET.value),
+        )
+        super(MotorConnectionField, self).__init__(type, *args, **kwargs)
+
     @classmethod
     async def resolve_connection(cls, connection_type, args, resolved):
         """
@@ -41,30 +232,58 @@ class MotorConnectionField(relay.ConnectionField):
         Args:
             connection_type: relay connection type
             args (dict): query arguments
-            resolved (tuple): pair of mongo motor collection cursor and count values
+            resolved (MotorQuery): query of the connection documents
 
         Returns:
-            relay.Connection: connection_type with query limited by limit and offset
+            relay.Connection: connection_type with paginated query documents
+        """
+        if args.get("pagination") == Pagination.OFFSET.value:
+            connection = await cls.resolve_offset_connection(
+                connection_type, args, resolved
+            )
+        else:
+            connection = await cls.resolve_keyset_connection(
+                connection_type, args, resolved
+            )
+        connection.query = resolved
+        return connection
+
+    @classmethod
+    async def resolve_offset_connection(cls, connection_type, args, query):
+        """
+        Paginate query with skip/limit offsets, cursors hold document index.
+
+        One extra document is fetched to find out whether the next page exists,
+        documents are counted only for the last page without before cursor.
         """
-        cursor, count = resolved
+        count = None
+        if args.get("last") and not args.get("before"):
+            count = await query.count()
         limit, skip = limitskip(count, **args)
 
-        if limit:
-            cursor.limit(limit)
+        docs = []
+        # zero limit of mongo cursor is no limit
+        if limit != 0:
+            docs = await query.fetch(
+                skip=skip, limit=limit + 1 if limit is not None else 0
+            )
 
-        if skip:
-            cursor.skip(skip)
+        has_more = limit is not None and len(docs) > limit
+        if has_more:
+            docs = docs[:limit]
 
         edges = [
-            connection_type.Edge(node=doc, cursor=offset_to_cursor(skip + idx))
-            for idx, doc in enumerate([_ async for _ in cursor], 1)
+            connection_type.Edge(
+                node=localize_datetimes(doc, query.timezone),
+                cursor=offset_to_cursor(skip + idx),
+            )
+            for idx, doc in enumerate(docs, 1)
         ]
 
         first_edge_cursor = edges[0].cursor if edges else None
         first_edge_index = get_offset_with_default(first_edge_cursor)
 
         last_edge_cursor = edges[-1].cursor if edges else None
-        last_edge_index = get_offset_with_default(last_edge_cursor)
 
         return connection_type(
             edges=edges,
@@ -72,6 +291,58 @@ class MotorConnectionField(relay.ConnectionField):
                 start_cursor=first_edge_cursor,
                 end_cursor=last_edge_cursor,
                 has_previous_page=first_edge_index > 1,
-                has_next_page=last_edge_index < count,
+                has_next_page=has_more,
+            ),
+        )
+
+    @classmethod
+    async def resolve_keyset_connection(cls, connection_type, args, query):
+        """
+        Paginate query with range predicates on the sort fields.
+
+        Cursors hold sort field values of the edge document, so every page is
+        fetched from the index position of the cursor without skipping documents.
+        """
+        after, before = args.get("after"), args.get("before")
+        first, last = args.get("first"), args.get("last")
+
+        filters = []
+        if after:
+            keys = cursor_to_keyset(query.sort, after)
+            filters.append(keyset_filter(query.sort, keys))
+        if before:
+            keys = cursor_to_keyset(query.sort, before)
+            filters.append(keyset_filter(query.sort, keys, forward=False))
+
+        # the page is taken from the end of the query when only last is passed
+        backward = bool(last) and not first
+        sort = query.sort
+        if backward:
+            sort = [(field, -direction) for field, direction in query.sort]
+
+        limit = first or last
+        docs = await query.fetch(filters, sort=sort, limit=limit and limit + 1)
+
+        has_more = bool(limit) and len(docs) > limit
+        if has_more:
+            docs = docs[:limit]
+        if backward:
+            docs.reverse()
+
+        # cursors hold stored values, so they are built before the conversion
+        edges = [
+            connection_type.Edge(
+                node=localize_datetimes(doc, query.timezone),
+                cursor=keyset_to_cursor(query.sort, doc),
+            )
+            for doc in docs
+        ]
+        return connection_type(
+            edges=edges,
+            page_info=graphene.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backward else bool(after),
+                has_next_page=bool(before) if backward else has_more,
             ),
         )
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import math
+from functools import partial
+
+from graphql import parse, validate
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+
+from cache import TTLCache
+
+
+class PersistedQueryError(Exception):
+    """
+    Error of the persisted query protocol which is returned to the client.
+
+    Args:
+        message (str): error message, clients match it to register queries
+        code (str): error code of the error extensions
+    """
+
+    def __init__(self, message, code):
+        super(PersistedQueryError, self).__init__(message)
+        self.code = code
+
+    def as_dict(self):
+        return {"message": str(self), "extensions": {"code": self.code}}
+
+
+def query_hash(query):
+    """Return SHA-256 hex digest which identifies the query text."""
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def load_allowlist(path):
+    """
+    Load pre-registered queries from JSON file.
+
+    Args:
+        path (str): path to JSON list of queries or object of queries by hash
+
+    Returns:
+        dict: queries by hash
+    """
+    with open(path) as file:
+        queries = json.load(file)
+    if isinstance(queries, list):
+        return {query_hash(query): query for query in queries}
+    for hash, query in queries.items():
+        if query_hash(query) != hash:
+            raise Exception(f"Hash {hash} of the allow-list does not match query.")
+    return dict(queries)
+
+
+def invalid_result(errors, *args, **kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+class PersistedQueryBackend(GraphQLBackend):
+    """
+    GraphQL backend which keeps parsed and validated documents by query hash.
+
+    Documents are validated once, executions of cached documents skip both
+    parsing and validation. Least recently used documents are evicted when
+    the cache is full, documents of the allow-list are never evicted.
+
+    Args:
+        maxsize (int): maximum number of cached documents
+        allowlist (dict): queries by hash, only these queries are served if passed
+    """
+
+    def __init__(self, maxsize=1000, allowlist=None):
+        self.allowlist = allowlist
+        self._documents = TTLCache(maxsize, math.inf)
+        self._allowed_documents = {}
+
+    def document_from_string(self, schema, request_string):
+        document = self.get_document(schema, query_hash(request_string), request_string)
+        if document is None:
+            raise PersistedQueryError(
+                "Operation is not in the allow-list.", "OPERATION_NOT_ALLOWED"
+            )
+        return document
+
+    def get_document(self, schema, hash, query=None):
+        """
+        Return document of the query hash, query is parsed and validated once.
+
+        Args:
+            schema (graphene.Schema): schema which validates the query
+            hash (str): SHA-256 hex digest of the query
+            query (str): query text, it registers the unknown hash
+
+        Returns:
+            GraphQLDocument: document or None for unknown or not allowed hash
+        """
+        if self.allowlist is not None:
+            if (document := self._allowed_documents.get(hash)) is None:
+                if (query := self.allowlist.get(hash)) is None:
+                    return None
+                document = self.build_document(schema, query)
+                self._allowed_documents[hash] = document
+            return document
+
+        if (document := self._documents.get(hash)) is None:
+            if query is None:
+                return None
+            document = self.build_document(schema, query)
+            self._documents.set(hash, document)
+        return document
+
+    def build_document(self, schema, query):
+        document_ast = parse(query)
+        if errors := validate(schema, document_ast):
+            execute_document = partial(invalid_result, errors)
+        else:
+            execute_document = partial(execute, schema, document_ast)
+        return GraphQLDocument(schema, query, document_ast, execute_document)
+
+    def resolve_query(self, schema, data):
+        """
+        Return query text of the operation request.
+
+        Requests of automatic persisted queries pass hash of the query in
+        extensions.persistedQuery.sha256Hash, unknown hashes are rejected with
+        PersistedQueryNotFound error, so the client sends the query along with
+        the hash to register it.
+
+        Args:
+            schema (graphene.Schema): schema which validates the query
+            data (dict): operation request
+
+        Raises:
+            PersistedQueryError: hash is unknown, does not match query or the
+                query is not allowed
+        """
+        query = data.get("query")
+        persisted = (data.get("extensions") or {}).get("persistedQuery")
+        if persisted is None:
+            if self.allowlist is not None:
+                raise PersistedQueryError(
+                    "Only persisted queries are allowed.", "OPERATION_NOT_ALLOWED"
+                )
+            if not query:
+                raise PersistedQueryError(
+                    "No GraphQL query found in the request.", "BAD_REQUEST"
+                )
+            return query
+
+        hash = persisted.get("sha256Hash")
+        if self.allowlist is not None and hash not in self.allowlist:
+            raise PersistedQueryError(
+                "Operation is not in the allow-list.", "OPERATION_NOT_ALLOWED"
+            )
+        if query is not None:
+            if query_hash(query) != hash:
+                raise PersistedQueryError(
+                    "Provided sha does not match query.", "INVALID_HASH"
+                )
+            # document of the query is registered by the execution
+            return query
+        if (document := self.get_document(schema, hash)) is None:
+            raise PersistedQueryError(
+                "PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND"
+            )
+        return document.document_string
@@ -1,27 +1,58 @@
-import re
+import os
 import uuid
 
 import graphene
-import pytz
 from graphene import relay
 
-from pagination import MotorConnectionField
-
-
-def get_event_projection():
-    return {
-        "id": 1,
-        "_id": 0,
-        "name": 1,
-        "event_type": 1,
-        "description": 1,
-        "address": 1,
-        "created_by": 1,
-        "created_date": 1,
-        "changed_date": 1,
-        "longitude": {"$arrayElemAt": ["$location.coordinates", 0]},
-        "latitude": {"$arrayElemAt": ["$location.coordinates", -1]},
-    }
+from cache import ResponseCache, load_backend
+from clusters import get_clusters
+from geo import (
+    bbox_filter,
+    center_sphere,
+    distance_expression,
+    geo_near_stage,
+    validate_bbox,
+)
+from pagination import MotorConnectionField, MotorQuery, localize_datetimes
+from selections import get_selected_fields
+
+EVENTS_CACHE_TTL = float(os.getenv("EVENTS_CACHE_TTL", 5))
+EVENTS_CACHE_SIZE = int(os.getenv("EVENTS_CACHE_SIZE", 1000))
+EVENTS_CACHE_BACKEND = os.getenv("EVENTS_CACHE_BACKEND")
+
+events_cache = ResponseCache(
+    load_backend(EVENTS_CACHE_BACKEND, EVENTS_CACHE_SIZE, EVENTS_CACHE_TTL),
+    EVENTS_CACHE_TTL,
+)
+
+EVENT_FIELDS_PROJECTION = {
+    "event_type": 1,
+    "description": 1,
+    "address": 1,
+    "created_by": 1,
+    "created_date": 1,
+    "changed_date": 1,
+    "longitude": {"$arrayElemAt": ["$location.coordinates", 0]},
+    "latitude": {"$arrayElemAt": ["$location.coordinates", -1]},
+}
+
+
+def get_event_projection(fields=None):
+    """
+    Return projection of the event documents.
+
+    Args:
+        fields (set): names of Event fields to project, all fields if None
+    """
+    projection = {"id": 1, "_id": 0}
+    projection.update(
+        {
+            field: value
+            for field, value in EVENT_FIELDS_PROJECTION.items()
+            if fields is None or field in fields
+        }
+    )
+    return projection
 
 
 class EventType(graphene.Enum):
@@ -35,6 +66,29 @@ class EventType(graphene.Enum):
     POLICE = 8
 
 
+class EventOrder(graphene.Enum):
+    CHANGED_DATE = 1
+    RELEVANCE = 2
+    DISTANCE = 3
+
+
+class NearInput(graphene.InputObjectType):
+    longitude = graphene.Float(required=True)
+    latitude = graphene.Float(required=True)
+    max_distance = graphene.Float(description="Maximum distance in meters.")
+
+
+class BoundingBoxInput(graphene.InputObjectType):
+    west = graphene.Float(required=True)
+    south = graphene.Float(required=True)
+    east = graphene.Float(required=True)
+    north = graphene.Float(required=True)
+
+
+class WithinInput(graphene.InputObjectType):
+    bbox = graphene.InputField(BoundingBoxInput, required=True)
+
+
 class User(graphene.ObjectType):
     id = graphene.UUID(required=True)
     username = graphene.String(required=True)
@@ -55,51 +109,132 @@ class Event(graphene.ObjectType):
     created_date = graphene.DateTime()
     changed_date = graphene.DateTime()
 
+    distance = graphene.Float(description="Distance in meters to the near point.")
+
     @staticmethod
     async def get_node(info, id):
-        collection = info.context["db"].events
-        doc = await collection.find_one({"id": uuid.UUID(id)}, get_event_projection())
-        return Event(**doc)
+        loader = info.context["loaders"].event(get_selected_fields(info))
+        doc = await loader.load(uuid.UUID(id))
+        if doc is None:
+            return None
+        return Event(**localize_datetimes(doc, info.context["timezone"]))
 
-    @staticmethod
-    async def resolve_created_date(root, info, **kwargs):
-        timezone = pytz.timezone(info.context["timezone"])
-        return (
-            root.created_date.astimezone(timezone)
-            if root.created_date is not None
-            else None
-        )
 
-    @staticmethod
-    async def resolve_changed_date(root, info, **kwargs):
-        timezone = pytz.timezone(info.context["timezone"])
-        return (
-            root["changed_date"].astimezone(timezone)
-            if "changed_date" in root
-            else None
-        )
+class EventTypeCount(graphene.ObjectType):
+    event_type = graphene.Field(type=EventType)
+    count = graphene.Int()
+
+
+class EventCluster(graphene.ObjectType):
+    id = graphene.String(description="Grid cell of the cluster.")
+    count = graphene.Int()
+    longitude = graphene.Float()
+    latitude = graphene.Float()
+    event_types = graphene.List(EventTypeCount)
 
 
 class EventConnection(relay.Connection):
     class Meta:
         node = Event
 
+    total_count = graphene.Int()
+
+    @staticmethod
+    async def resolve_total_count(root, info, **kwargs):
+        return await root.query.count(estimated=True)
+
 
 class Query(graphene.ObjectType):
     event = relay.Node.Field(Event)
-    events = MotorConnectionField(EventConnection, search=graphene.String())
+    events = MotorConnectionField(
+        EventConnection,
+        search=graphene.String(),
+        near=graphene.Argument(NearInput),
+        within=graphene.Argument(WithinInput),
+        order_by=graphene.Argument(
+            EventOrder,
+            description=(
+                "Defaults to DISTANCE for near queries, RELEVANCE for search "
+                "queries, else CHANGED_DATE."
+            ),
+        ),
+    )
+
+    event_clusters = graphene.List(
+        EventCluster,
+        bbox=graphene.Argument(BoundingBoxInput, required=True),
+        zoom=graphene.Int(required=True),
+        event_types=graphene.List(graphene.NonNull(EventType)),
+        description="Event clusters of the map tiles which cover the bounding box.",
+    )
+
+    @staticmethod
+    async def resolve_event_clusters(root, info, bbox, zoom, event_types=None):
+        return await get_clusters(
+            info.context["db"].events, zoom=zoom, event_types=event_types, **bbox
+        )
 
     @staticmethod
     async def resolve_events(root, info, **kwargs):
-        filter = {}
-        if value := kwargs.get("search"):
-            # TODO replace filter with mongo text index
-            pattern = re.compile(f".*{value}.*", re.IGNORECASE)
-            filter.update({"address": pattern})
-
-        collection = info.context["db"].events
-        count = await collection.count_documents(filter)
-        cursor = collection.find(filter, get_event_projection()).sort(
-            [("changed_date", -1)]
+        search = kwargs.get("search")
+        near = kwargs.get("near")
+        within = kwargs.get("within")
+        order_by = kwargs.get("order_by")
+        if order_by is None:
+            order_by = EventOrder.CHANGED_DATE.value
+            if near:
+                order_by = EventOrder.DISTANCE.value
+            elif search:
+                order_by = EventOrder.RELEVANCE.value
+        if order_by == EventOrder.DISTANCE.value and not near:
+            raise Exception("Events can be ordered by distance with near only.")
+        if order_by == EventOrder.RELEVANCE.value and not search:
+            raise Exception("Events can be ordered by relevance with search only.")
+
+        filters = []
+        if within:
+            validate_bbox(**within.bbox)
+            filters.append(bbox_filter(**within.bbox))
+
+        pipeline = []
+        if near and not search:
+            # $geoNear walks the 2dsphere index in the order of distance
+            query = {"$and": filters} if filters else None
+            pipeline.append(
+                geo_near_stage(
+                    near.longitude, near.latitude, near.max_distance, query=query
+                )
+            )
+        else:
+            if search:
+                # $text and $geoNear are not allowed in the same pipeline
+                filters.insert(0, {"$text": {"$search": search}})
+            if near and near.max_distance is not None:
+                shape = center_sphere(near.longitude, near.latitude, near.max_distance)
+                filters.append({"location": {"$geoWithin": shape}})
+            if filters:
+                pipeline.append({"$match": {"$and": filters}})
+            if near:
+                distance = distance_expression(near.longitude, near.latitude)
+                pipeline.append({"$addFields": {"distance": distance}})
+
+        fields = get_selected_fields(info, "edges", "node")
+        projection = get_event_projection(fields)
+        if near and "distance" in fields:
+            projection["distance"] = 1
+
+        sort = [("changed_date", -1), ("id", -1)]
+        if order_by == EventOrder.DISTANCE.value:
+            sort = [("distance", 1), ("id", 1)]
+        elif order_by == EventOrder.RELEVANCE.value:
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+            sort.insert(0, ("score", -1))
+
+        return MotorQuery(
+            info.context["db"].events,
+            pipeline,
+            sort=sort,
+            projection=projection,
+            timezone=info.context["timezone"],
+            cache=events_cache,
         )
-        return cursor, count
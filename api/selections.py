@@ -0,0 +1,43 @@
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+
+
+def iter_fields(info, selection_sets):
+    """Yield field nodes of the selection sets, fragments are flattened."""
+    for selection_set in selection_sets:
+        if selection_set is None:
+            continue
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                fragment = info.fragments[selection.name.value]
+                yield from iter_fields(info, [fragment.selection_set])
+            elif isinstance(selection, ast.InlineFragment):
+                yield from iter_fields(info, [selection.selection_set])
+            else:
+                yield selection
+
+
+def get_selected_fields(info, *path):
+    """
+    Return python names of the fields selected under the path of resolved field.
+
+    Directives are not evaluated, so fields skipped by @skip or @include are
+    returned as well.
+
+    Args:
+        info: graphql resolve info
+        path (str): names of nested fields, e.g. "edges", "node" for connections
+
+    Returns:
+        set: snake case names of the selected fields
+    """
+    selection_sets = [field.selection_set for field in info.field_asts]
+    for name in path:
+        selection_sets = [
+            field.selection_set
+            for field in iter_fields(info, selection_sets)
+            if field.name.value == name
+        ]
+    return {
+        to_snake_case(field.name.value) for field in iter_fields(info, selection_sets)
+    }
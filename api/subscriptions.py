@@ -0,0 +1,184 @@
+import asyncio
+
+import graphene
+from graphql.execution import ExecutionResult
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from graphql_relay import to_global_id
+from starlette.graphql import format_graphql_error
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from geo import validate_bbox
+from mutations import get_event_from_document
+from queries import BoundingBoxInput, Event, EventType
+
+# subprotocol of subscriptions-transport-ws, which is used by apollo clients
+GRAPHQL_WS = "graphql-ws"
+
+
+class EventChangeOperation(graphene.Enum):
+    INSERT = "insert"
+    UPDATE = "update"
+    REPLACE = "replace"
+    DELETE = "delete"
+
+
+class EventChange(graphene.ObjectType):
+    operation = graphene.Field(EventChangeOperation, required=True)
+    id = graphene.ID(required=True, description="Global id of the changed event.")
+    event = graphene.Field(
+        Event,
+        description=(
+            "Changed event, null for deletes and for the events which are "
+            "outside of the bounding box and may have left it."
+        ),
+    )
+
+
+class Subscription(graphene.ObjectType):
+    event_changed = graphene.Field(
+        EventChange,
+        bbox=graphene.Argument(BoundingBoxInput, required=True),
+        event_types=graphene.List(graphene.NonNull(EventType)),
+        description=(
+            "Changes of the events inside the bounding box, events which leave "
+            "the bounding box are delivered as well. Deletes of the events whose "
+            "previous location is unknown to the server are delivered to all "
+            "subscriptions, their updates outside of the bounding box without "
+            "the event."
+        ),
+    )
+
+    @staticmethod
+    async def resolve_event_changed(root, info, bbox, event_types=None):
+        validate_bbox(**bbox)
+        changes = info.context["changes"].subscribe(
+            dict(bbox), event_types, window=info.context.get("window")
+        )
+        async for change in changes:
+            event = None
+            if change["document"] is not None:
+                event = get_event_from_document(
+                    change["document"], info.context["timezone"]
+                )
+            yield EventChange(
+                operation=change["operation"],
+                id=to_global_id("Event", str(change["id"])),
+                event=event,
+            )
+
+
+def format_result(result):
+    payload = {"data": result.data}
+    if result.errors:
+        payload["errors"] = [format_graphql_error(err) for err in result.errors]
+    return payload
+
+
+async def execute_subscription(
+    websocket, id, schema, payload, context, backend=None, window_size=10
+):
+    """
+    Execute operation of the start message and send results to the websocket.
+
+    Results are pushed by the subscription observable, the window of
+    undelivered results stops the subscription source while the client
+    receives them.
+    """
+    window = asyncio.Semaphore(window_size)
+    result = await schema.execute(
+        payload.get("query"),
+        variables=payload.get("variables"),
+        operation_name=payload.get("operationName"),
+        context=dict(context, window=window),
+        executor=AsyncioExecutor(),
+        allow_subscriptions=True,
+        return_promise=True,
+        backend=backend,
+    )
+    if isinstance(result, ExecutionResult):
+        await websocket.send_json(
+            {"type": "data", "id": id, "payload": format_result(result)}
+        )
+        await websocket.send_json({"type": "complete", "id": id})
+        return
+
+    results = asyncio.Queue()
+    subscription = result.subscribe(
+        on_next=results.put_nowait,
+        on_error=results.put_nowait,
+        on_completed=lambda: results.put_nowait(None),
+    )
+    try:
+        while (item := await results.get()) is not None:
+            if isinstance(item, Exception):
+                error = {"message": str(item)}
+                await websocket.send_json({"type": "error", "id": id, "payload": error})
+                break
+            await websocket.send_json(
+                {"type": "data", "id": id, "payload": format_result(item)}
+            )
+            window.release()
+        await websocket.send_json({"type": "complete", "id": id})
+    finally:
+        subscription.dispose()
+
+
+async def serve_subscriptions(
+    websocket: WebSocket, schema, authenticate, context, **options
+):
+    """
+    Serve GraphQL subscriptions with subscriptions-transport-ws protocol.
+
+    Args:
+        websocket (WebSocket): connection of the client
+        schema (graphene.Schema): schema with subscriptions
+        authenticate: function which returns credentials of the token from
+            authorization of connection_init payload or raises exception
+        context (dict): execution context of the connection operations
+        options: backend and window_size of execute_subscription
+    """
+    await websocket.accept(subprotocol=GRAPHQL_WS)
+    operations = {}
+    try:
+        message = await websocket.receive_json()
+        if message.get("type") != "connection_init":
+            await websocket.close(code=4400)
+            return
+        try:
+            authorization = (message.get("payload") or {}).get("authorization", "")
+            _, _, token = authorization.partition(" ")
+            context = dict(context, credentials=authenticate(token))
+        except Exception as err:
+            error = {"message": getattr(err, "detail", str(err))}
+            await websocket.send_json({"type": "connection_error", "payload": error})
+            await websocket.close(code=4401)
+            return
+        await websocket.send_json({"type": "connection_ack"})
+
+        while True:
+            message = await websocket.receive_json()
+            type, id = message.get("type"), message.get("id")
+            if type == "start":
+                if (task := operations.pop(id, None)) is not None:
+                    task.cancel()
+                operations[id] = asyncio.ensure_future(
+                    execute_subscription(
+                        websocket,
+                        id,
+                        schema,
+                        message.get("payload") or {},
+                        context,
+                        **options,
+                    )
+                )
+            elif type == "stop":
+                if (task := operations.pop(id, None)) is not None:
+                    task.cancel()
+            elif type == "connection_terminate":
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in operations.values():
+            task.cancel()
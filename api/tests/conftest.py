@@ -2,6 +2,13 @@ import pytest
 from motor.motor_asyncio import AsyncIOMotorClient
 
 import main
+import queries
+
+
+@pytest.fixture(autouse=True)
+async def events_cache():
+    await queries.events_cache.invalidate()
+    return queries.events_cache
 
 
 @pytest.fixture
@@ -14,5 +21,8 @@ async def db():
     client = AsyncIOMotorClient(
         main.DATABASE_HOST, main.DATABASE_PORT, uuidRepresentation="standard"
     )
+    # tests count the events of the collection, so every test starts empty
+    await client.drop_database(main.DATABASE_NAME)
     yield client[main.DATABASE_NAME]
-    client.drop_database("test")
+    await client.drop_database(main.DATABASE_NAME)
+    client.close()
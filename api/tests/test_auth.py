@@ -0,0 +1,38 @@
+import time
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+
+import main
+from auth import TokenCache
+
+
+@pytest.fixture
+async def token_cache(monkeypatch):
+    cache = TokenCache(10, 60)
+    monkeypatch.setattr(main, "token_cache", cache)
+    return cache
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_verified_token_cache(user, token_cache):
+    token = jwt.encode(
+        {**user, "exp": time.time() + 600}, main.SECRET_KEY, algorithm="HS256"
+    )
+    credentials = HTTPAuthorizationCredentials(scheme="bearer", credentials=token)
+
+    assert await main.get_current_user_creadentials(credentials) == user
+    assert await main.get_current_user_creadentials(credentials) == user
+    assert token_cache.as_dict() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_token_cache_expiration():
+    cache = TokenCache(10, 60)
+    cache.set("expired", {"id": "1"}, time.time() - 1)
+    cache.set("expiring", {"id": "2"}, time.time() + 0.01)
+    assert cache.get("expired") is None
+    assert cache.get("expiring") == {"id": "2"}
+    time.sleep(0.02)
+    assert cache.get("expiring") is None
@@ -0,0 +1,33 @@
+import pytest
+
+import main
+from tests.utils import post
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_batch(user):
+    response = await post(
+        [
+            {"query": "{ events(first: 1) { edges { node { id } } } }"},
+            {"query": "{ events { totalCount } }"},
+            {"query": "{ unknown }"},
+        ],
+        user,
+    )
+    assert response.status_code == 200
+    first, second, third = response.json()
+    assert first == {"data": {"events": {"edges": []}}}
+    assert second == {"data": {"events": {"totalCount": 0}}}
+    assert third["errors"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_batch_size(user, monkeypatch):
+    monkeypatch.setattr(main, "GRAPHQL_MAX_BATCH_SIZE", 2)
+    response = await post([{"query": "{ events { totalCount } }"}] * 3, user)
+    assert response.status_code == 400
+
+    response = await post([], user)
+    assert response.status_code == 400
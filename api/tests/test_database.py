@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from database import (
+    EVENTS_INDEXES,
+    collection_scans,
+    ensure_indexes,
+    log_index_failure,
+    reconcile_indexes,
+)
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes(db):
+    await db.events.drop_indexes()
+    built = await ensure_indexes(db)
+    assert built == [index.document["name"] for index in EVENTS_INDEXES]
+    assert await ensure_indexes(db) == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_changed_index(db):
+    await db.reconciled.drop()
+    await db.reconciled.create_index([("id", ASCENDING)], name="id")
+    indexes = [IndexModel([("id", ASCENDING)], name="id", unique=True)]
+    assert await reconcile_indexes(db.reconciled, indexes) == ["id"]
+    assert (await db.reconciled.index_information())["id"]["unique"]
+    assert await reconcile_indexes(db.reconciled, indexes) == []
+    await db.reconciled.drop()
+
+
+def test_collection_scans():
+    explain = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "SORT",
+                "inputStage": {"stage": "COLLSCAN", "direction": "forward"},
+            },
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }
+    }
+    assert collection_scans(explain) == [{"stage": "COLLSCAN", "direction": "forward"}]
+
+    explain["queryPlanner"]["winningPlan"]["inputStage"] = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "IXSCAN", "indexName": "changed_date_id"},
+    }
+    assert collection_scans(explain) == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_dropped_index(db, monkeypatch):
+    collection = db.reconciled
+    await collection.drop()
+    await collection.create_index([("id", ASCENDING)], name="id")
+    drop_index = collection.drop_index
+
+    async def drop_dropped(name):
+        # another worker drops the index between the snapshot and the drop
+        await drop_index(name)
+        raise OperationFailure("index not found with name [id]", code=27)
+
+    monkeypatch.setattr(collection, "drop_index", drop_dropped, raising=False)
+    indexes = [IndexModel([("id", ASCENDING)], name="id", unique=True)]
+    assert await reconcile_indexes(collection, indexes) == ["id"]
+    assert (await collection.index_information())["id"]["unique"]
+    await collection.drop()
+
+
+@pytest.mark.asyncio
+async def test_log_index_failure(caplog):
+    async def fail():
+        raise Exception("Index build failed")
+
+    task = asyncio.ensure_future(fail())
+    task.add_done_callback(log_index_failure)
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert "Index build failed" in caplog.text
@@ -1,11 +1,15 @@
+import asyncio
 import random
 import uuid
 from datetime import datetime, timedelta
 
 import pytest
 from graphql_relay import to_global_id
+from graphql_relay.connection.arrayconnection import offset_to_cursor
 
-from tests.utils import graphql
+import mutations
+from pagination import limitskip
+from tests.utils import graphql, post
 
 
 @pytest.fixture
@@ -87,7 +91,7 @@ async def events(db, faker, user):
     collection = db.events
     await collection.insert_many(_events.copy())
     yield _events
-    await collection.delete_many({"if": {"$in": [itm["id"] for itm in _events]}})
+    await collection.delete_many({"id": {"$in": [itm["id"] for itm in _events]}})
 
 
 @pytest.fixture
@@ -110,7 +114,7 @@ async def events_with_sprcific_address(db, faker, user, event_address):
     collection = db.events
     await collection.insert_many(_events.copy())
     yield _events
-    await collection.delete_many({"if": {"$in": [itm["id"] for itm in _events]}})
+    await collection.delete_many({"id": {"$in": [itm["id"] for itm in _events]}})
 
 
 @pytest.mark.asyncio
@@ -309,6 +313,93 @@ async def test_update(db, user, event_global_id, input, result):
     assert doc["address"] == "Updated event"
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db", "user", "event_global_id", "event")
+async def test_update_expected_changed_date(db, user, event_global_id):
+    query = """
+        mutation updateEvent($id: ID!, $address: String, $expected: DateTime) {
+            updateEvent (
+                input: {id: $id, address: $address, expectedChangedDate: $expected}
+            ) {
+                address
+                changedDate
+            }
+        }
+        """
+    response = await graphql(
+        "query event($id: ID!) { event(id: $id) { ... on Event { changedDate } } }",
+        creadentials=user,
+        id=event_global_id,
+    )
+    changed_date = response.json()["data"]["event"]["changedDate"]
+
+    response = await graphql(
+        query,
+        creadentials=user,
+        id=event_global_id,
+        address="First editor",
+        expected=changed_date,
+    )
+    assert response.status_code == 200
+    assert response.json()["data"]["updateEvent"]["address"] == "First editor"
+
+    response = await graphql(
+        query,
+        creadentials=user,
+        id=event_global_id,
+        address="Second editor",
+        expected=changed_date,
+    )
+    assert response.status_code == 400
+    assert "changed by another request" in response.json()["errors"][0]["message"]
+
+    doc = await db.events.find_one({}, {"_id": 0, "address": 1})
+    assert doc["address"] == "First editor"
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db", "user")
+async def test_update_created_changed_date(db, user):
+    response = await graphql(
+        """
+        mutation createEvent($address: String!) {
+            createEvent (
+                input: {
+                    eventType: FIRE, address: $address, longitude: 0, latitude: 0
+                }
+            ) {
+                id
+                changedDate
+            }
+        }
+        """,
+        creadentials=user,
+        address="Created event",
+    )
+    event = response.json()["data"]["createEvent"]
+
+    response = await graphql(
+        """
+        mutation updateEvent($id: ID!, $expected: DateTime) {
+            updateEvent (
+                input: {id: $id, address: "Updated", expectedChangedDate: $expected}
+            ) {
+                address
+            }
+        }
+        """,
+        creadentials=user,
+        id=event["id"],
+        expected=event["changedDate"],
+    )
+    assert response.status_code == 200
+    assert response.json()["data"]["updateEvent"]["address"] == "Updated"
+
+
+def test_current_date_milliseconds():
+    assert mutations.get_current_date().microsecond % 1000 == 0
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures("db", "user", "event_address", "event_global_id", "event")
 async def test_delete(db, user, event_address, event_global_id):
@@ -329,3 +420,567 @@ async def test_delete(db, user, event_address, event_global_id):
 
     doc = await db.events.find_one({}, {"_id": 0, "events": 1, "address": 1})
     assert not doc
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db", "user")
+async def test_create_many(db, user, monkeypatch):
+    monkeypatch.setattr(mutations, "EVENTS_BATCH_SIZE", 2)
+    inputs = [
+        {
+            "eventType": "FIRE",
+            "address": f"address-{idx}",
+            "longitude": 0,
+            "latitude": 0,
+        }
+        for idx in range(5)
+    ]
+    inputs[1]["address"] = ""
+    response = await graphql(
+        """
+        mutation createEvents($inputs: [EventInput!]!) {
+            createEvents (input: {inputs: $inputs}) {
+                results {
+                    event {
+                        address
+                    }
+                    error
+                }
+            }
+        }
+        """,
+        creadentials=user,
+        inputs=inputs,
+    )
+
+    assert response.status_code == 200
+    results = response.json()["data"]["createEvents"]["results"]
+    assert [result["event"] and result["event"]["address"] for result in results] == [
+        "address-0",
+        None,
+        "address-2",
+        "address-3",
+        "address-4",
+    ]
+    assert results[1]["error"] == "Address value cannot be empty string"
+    addresses = [input["address"] for input in inputs]
+    assert await db.events.count_documents({"address": {"$in": addresses}}) == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db", "user", "events")
+async def test_delete_many(db, user, events, monkeypatch):
+    monkeypatch.setattr(mutations, "EVENTS_BATCH_SIZE", 2)
+    ids = [to_global_id("Event", str(event["id"])) for event in events[:3]]
+    ids.append(to_global_id("Event", str(uuid.uuid4())))
+    response = await graphql(
+        """
+        mutation deleteEvents($ids: [ID!]!) {
+            deleteEvents (input: {ids: $ids}) {
+                results {
+                    event {
+                        address
+                    }
+                    error
+                }
+            }
+        }
+        """,
+        creadentials=user,
+        ids=ids,
+    )
+
+    assert response.status_code == 200
+    results = response.json()["data"]["deleteEvents"]["results"]
+    assert [result["event"] for result in results[:3]] == [
+        {"address": event["address"]} for event in events[:3]
+    ]
+    assert "is not exist" in results[3]["error"]
+    event_ids = [event["id"] for event in events]
+    remaining = await db.events.count_documents({"id": {"$in": event_ids}})
+    assert remaining == len(events) - 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db", "user", "events")
+async def test_delete_many_concurrently(db, user, events):
+    ids = [to_global_id("Event", str(event["id"])) for event in events[:10]]
+    query = """
+        mutation deleteEvents($ids: [ID!]!) {
+            deleteEvents (input: {ids: $ids}) {
+                results {
+                    event {
+                        address
+                    }
+                }
+            }
+        }
+        """
+    responses = await asyncio.gather(
+        graphql(query, creadentials=user, ids=ids),
+        graphql(query, creadentials=user, ids=ids[5:] + ids[:5]),
+    )
+
+    # every event is reported as deleted by one of the requests only
+    deleted = [
+        result["event"]["address"]
+        for response in responses
+        for result in response.json()["data"]["deleteEvents"]["results"]
+        if result["event"] is not None
+    ]
+    assert sorted(deleted) == sorted(event["address"] for event in events[:10])
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events")
+@pytest.mark.parametrize("pagination", ["KEYSET", "OFFSET"])
+async def test_list_pagination(user, events, pagination):
+    query = """
+        query fetchEvents ($pagination: Pagination, $after: String) {
+            events (pagination: $pagination, first: 30, after: $after) {
+                pageInfo {
+                    endCursor
+                    hasNextPage
+                }
+                edges {
+                    node {
+                        address
+                    }
+                }
+            }
+        }
+        """
+    addresses, after, has_next_page = [], None, True
+    while has_next_page:
+        response = await graphql(
+            query, creadentials=user, pagination=pagination, after=after
+        )
+        assert response.status_code == 200
+        data = response.json()["data"]["events"]
+        addresses += [edge["node"]["address"] for edge in data["edges"]]
+        after = data["pageInfo"]["endCursor"]
+        has_next_page = data["pageInfo"]["hasNextPage"]
+
+    assert addresses == [itm["address"] for itm in reversed(events)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events")
+async def test_list_keyset_backward(user, events):
+    query = """
+        query fetchEvents ($first: Int, $last: Int, $before: String) {
+            events (first: $first, last: $last, before: $before) {
+                pageInfo {
+                    hasPreviousPage
+                }
+                edges {
+                    cursor
+                    node {
+                        address
+                    }
+                }
+            }
+        }
+        """
+    response = await graphql(query, creadentials=user, first=60)
+    edges = response.json()["data"]["events"]["edges"]
+    response = await graphql(
+        query, creadentials=user, last=10, before=edges[50]["cursor"]
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]["events"]
+    assert data["edges"] == edges[40:50]
+    assert data["pageInfo"]["hasPreviousPage"] is True
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events", "events_with_sprcific_address")
+@pytest.mark.parametrize(
+    "variables,expected_count", [({}, 120), ({"search": "!@someTest_address"}, 20)]
+)
+async def test_list_total_count(user, variables, expected_count):
+    response = await graphql(
+        """
+        query fetchEvents ($search: String) {
+            events (search: $search, first: 5) {
+                totalCount
+                pageInfo {
+                    hasNextPage
+                }
+            }
+        }
+        """,
+        creadentials=user,
+        **variables,
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]["events"]
+    assert data["totalCount"] == expected_count
+    assert data["pageInfo"]["hasNextPage"] is True
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events")
+async def test_list_offset_last(user, events):
+    response = await graphql(
+        """
+        {
+            events (pagination: OFFSET, last: 10) {
+                pageInfo {
+                    hasNextPage
+                    hasPreviousPage
+                }
+                edges {
+                    node {
+                        address
+                    }
+                }
+            }
+        }
+        """,
+        creadentials=user,
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]["events"]
+    assert [edge["node"]["address"] for edge in data["edges"]] == [
+        itm["address"] for itm in reversed(events[:10])
+    ]
+    assert data["pageInfo"] == {"hasNextPage": False, "hasPreviousPage": True}
+
+
+@pytest.mark.parametrize(
+    "args,expected",
+    [
+        ({"first": 5, "after": offset_to_cursor(20)}, (5, 20)),
+        ({"last": 5, "before": offset_to_cursor(10)}, (5, 4)),
+        (
+            {"last": 5, "after": offset_to_cursor(20), "before": offset_to_cursor(10)},
+            (0, 20),
+        ),
+        (
+            {"first": 5, "after": offset_to_cursor(20), "before": offset_to_cursor(10)},
+            (0, 20),
+        ),
+    ],
+)
+def test_limitskip(args, expected):
+    assert limitskip(**args) == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events")
+@pytest.mark.parametrize("size", ["first", "last"])
+async def test_list_offset_empty_range(user, events, size):
+    response = await graphql(
+        f"""
+        query fetchEvents ($after: String, $before: String) {{
+            events (pagination: OFFSET, {size}: 10, after: $after, before: $before) {{
+                pageInfo {{
+                    hasNextPage
+                }}
+                edges {{
+                    node {{
+                        address
+                    }}
+                }}
+            }}
+        }}
+        """,
+        creadentials=user,
+        after=offset_to_cursor(20),
+        before=offset_to_cursor(10),
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]["events"]
+    assert data == {"pageInfo": {"hasNextPage": False}, "edges": []}
+
+
+@pytest.fixture
+@pytest.mark.usefixtures("db", "user")
+async def events_with_search_term(db, user):
+    def gen_events():
+        for idx, description in enumerate(["fire", "Baker street fire near Baker"]):
+            yield {
+                "id": uuid.uuid4(),
+                "event_type": 7,
+                "description": description,
+                "address": f"Baker street {idx}",
+                "location": {"type": "Point", "coordinates": [0, 0]},
+                "created_by": user,
+                "created_date": datetime.now() - timedelta(seconds=idx),
+                "changed_date": datetime.now() - timedelta(seconds=idx),
+            }
+
+    _events = list(gen_events())
+    await db.events.insert_many(_events.copy())
+    yield _events
+    await db.events.delete_many({"id": {"$in": [itm["id"] for itm in _events]}})
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events_with_search_term")
+@pytest.mark.parametrize(
+    "order_by,expected",
+    [
+        ("RELEVANCE", ["Baker street 1", "Baker street 0"]),
+        ("CHANGED_DATE", ["Baker street 0", "Baker street 1"]),
+    ],
+)
+async def test_list_search_order(user, order_by, expected):
+    response = await graphql(
+        """
+        query fetchEvents ($orderBy: EventOrder) {
+            events (search: "baker", orderBy: $orderBy) {
+                edges {
+                    node {
+                        address
+                    }
+                }
+            }
+        }
+        """,
+        creadentials=user,
+        orderBy=order_by,
+    )
+
+    assert response.status_code == 200
+    edges = response.json()["data"]["events"]["edges"]
+    assert [edge["node"]["address"] for edge in edges] == expected
+
+
+@pytest.fixture
+@pytest.mark.usefixtures("db", "user")
+async def events_with_locations(db, user):
+    def gen_events():
+        for idx, longitude in enumerate([1, 0.01, 0]):
+            yield {
+                "id": uuid.uuid4(),
+                "event_type": 7,
+                "description": "fire" if idx else "",
+                "address": f"location-{idx}",
+                "location": {"type": "Point", "coordinates": [longitude, 0]},
+                "created_by": user,
+                "created_date": datetime.now(),
+                "changed_date": datetime.now(),
+            }
+
+    _events = list(gen_events())
+    await db.events.insert_many(_events.copy())
+    yield _events
+    await db.events.delete_many({"id": {"$in": [itm["id"] for itm in _events]}})
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events_with_locations")
+@pytest.mark.parametrize("search", [None, "fire"])
+async def test_list_near(user, search):
+    response = await graphql(
+        """
+        query fetchEvents ($search: String) {
+            events (
+                search: $search,
+                near: {longitude: 0, latitude: 0, maxDistance: 5000}
+            ) {
+                edges {
+                    node {
+                        address
+                        distance
+                    }
+                }
+            }
+        }
+        """,
+        creadentials=user,
+        search=search,
+    )
+
+    assert response.status_code == 200
+    nodes = [edge["node"] for edge in response.json()["data"]["events"]["edges"]]
+    # both "fire" events are inside maxDistance, near orders them by distance
+    assert [node["address"] for node in nodes] == ["location-2", "location-1"]
+    assert nodes[-1]["distance"] == pytest.approx(1113, rel=0.01)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events_with_locations")
+async def test_list_within(user):
+    response = await graphql(
+        """
+        {
+            events (within: {bbox: {west: -0.5, south: -0.5, east: 0.5, north: 0.5}}) {
+                edges {
+                    node {
+                        address
+                    }
+                }
+            }
+        }
+        """,
+        creadentials=user,
+    )
+
+    assert response.status_code == 200
+    edges = response.json()["data"]["events"]["edges"]
+    assert sorted(edge["node"]["address"] for edge in edges) == [
+        "location-1",
+        "location-2",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events_with_locations")
+async def test_event_clusters(user):
+    response = await graphql(
+        """
+        {
+            eventClusters (
+                bbox: {west: -10, south: -10, east: 10, north: 10},
+                zoom: 1,
+                eventTypes: [FIRE]
+            ) {
+                count
+                longitude
+                latitude
+                eventTypes {
+                    eventType
+                    count
+                }
+            }
+        }
+        """,
+        creadentials=user,
+    )
+
+    assert response.status_code == 200
+    clusters = response.json()["data"]["eventClusters"]
+    assert len(clusters) == 1
+    assert clusters[0]["count"] == 3
+    assert clusters[0]["longitude"] == pytest.approx(1.01 / 3)
+    assert clusters[0]["latitude"] == 0
+    assert clusters[0]["eventTypes"] == [{"eventType": "FIRE", "count": 3}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events")
+async def test_retrieve_many(user, events):
+    ids = [to_global_id("Event", str(itm["id"])) for itm in events[:2]]
+    response = await graphql(
+        """
+        query getEvents($first: ID!, $second: ID!) {
+            first: event(id: $first) {
+                address
+            }
+            second: event(id: $second) {
+                address
+            }
+            again: event(id: $first) {
+                address
+            }
+        }
+        """,
+        creadentials=user,
+        first=ids[0],
+        second=ids[1],
+    )
+
+    assert response.status_code == 200
+    assert response.json()["data"] == {
+        "first": {"address": events[0]["address"]},
+        "second": {"address": events[1]["address"]},
+        "again": {"address": events[0]["address"]},
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "event_global_id", "event_address", "event")
+async def test_projection_from_fragments(user, event_global_id, event_address):
+    response = await graphql(
+        """
+        query getEvents($id: ID!) {
+            events {
+                edges {
+                    node {
+                        ...EventFields
+                    }
+                }
+            }
+            event(id: $id) {
+                ... on Event {
+                    address
+                }
+                description
+            }
+        }
+
+        fragment EventFields on Event {
+            address
+            longitude
+        }
+        """,
+        creadentials=user,
+        id=event_global_id,
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["events"]["edges"] == [
+        {"node": {"address": event_address, "longitude": 0}}
+    ]
+    assert data["event"]["address"] == event_address
+    assert data["event"]["description"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "event")
+async def test_timezone(user):
+    query = """
+    {
+        events {
+            edges {
+                node {
+                    createdDate
+                    changedDate
+                }
+            }
+        }
+    }
+    """
+    response = await post({"query": query}, user, cookies={"timezone": "Etc/GMT-3"})
+    assert response.status_code == 200
+    (edge,) = response.json()["data"]["events"]["edges"]
+    assert edge["node"]["createdDate"].endswith("+03:00")
+    assert edge["node"]["changedDate"].endswith("+03:00")
+
+    response = await post({"query": query}, user, cookies={"timezone": "Mars/Base"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "events", "events_cache")
+async def test_list_cache(user, events, events_cache):
+    query = "{ events(first: 5) { totalCount edges { node { id } } } }"
+    first = await graphql(query, creadentials=user)
+    second = await graphql(query, creadentials=user)
+    assert first.json() == second.json()
+    assert events_cache.as_dict()["hits"] >= 2
+
+    response = await graphql(
+        """
+        mutation createEvent($address: String!) {
+            createEvent (input: {
+                eventType: FIRE, address: $address, longitude: 0, latitude: 0
+            }) {
+                id
+            }
+        }
+        """,
+        creadentials=user,
+        address="cached",
+    )
+    assert response.status_code == 200
+    response = await graphql(query, creadentials=user)
+    assert response.json()["data"]["events"]["totalCount"] == len(events) + 1
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+from loaders import DataLoader
+
+
+@pytest.mark.asyncio
+async def test_loader_batches_and_dedupes_keys():
+    batches = []
+
+    async def batch_load(keys):
+        batches.append(keys)
+        return {key: key * 2 for key in keys if key != 3}
+
+    loader = DataLoader(batch_load)
+    values = await asyncio.gather(
+        loader.load(1), loader.load(2), loader.load(1), loader.load(3)
+    )
+
+    assert values == [2, 4, 2, None]
+    assert batches == [[1, 2, 3]]
+
+    loader.prime(2, 5)
+    assert await loader.load_many([1, 2]) == [2, 5]
+    assert batches == [[1, 2, 3]]
@@ -0,0 +1,76 @@
+import pytest
+
+import main
+from persisted import PersistedQueryBackend, query_hash
+from tests.utils import post
+
+QUERY = "{ events(first: 1) { edges { node { id } } } }"
+
+
+@pytest.fixture
+async def persisted_queries(monkeypatch):
+    backend = PersistedQueryBackend(maxsize=10)
+    monkeypatch.setattr(main, "persisted_queries", backend)
+    return backend
+
+
+@pytest.fixture
+async def allowlisted_queries(monkeypatch):
+    backend = PersistedQueryBackend(allowlist={query_hash(QUERY): QUERY})
+    monkeypatch.setattr(main, "persisted_queries", backend)
+    return backend
+
+
+def persisted_query(query):
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "persisted_queries")
+async def test_persisted_query_registration(user):
+    response = await post({"extensions": persisted_query(QUERY)}, user)
+    assert response.status_code == 200
+    assert response.json()["errors"][0]["message"] == "PersistedQueryNotFound"
+
+    response = await post({"query": QUERY, "extensions": persisted_query(QUERY)}, user)
+    assert response.status_code == 200
+    assert response.json()["data"] == {"events": {"edges": []}}
+
+    response = await post({"extensions": persisted_query(QUERY)}, user)
+    assert response.status_code == 200
+    assert response.json()["data"] == {"events": {"edges": []}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "persisted_queries")
+async def test_persisted_query_hash_mismatch(user):
+    data = {"query": QUERY, "extensions": persisted_query("{ events { pageInfo } }")}
+    response = await post(data, user)
+    assert response.json()["errors"][0]["extensions"]["code"] == "INVALID_HASH"
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "persisted_queries")
+async def test_persisted_query_document_cache(user, persisted_queries):
+    await post({"query": QUERY}, user)
+    await post({"query": QUERY}, user)
+    document = persisted_queries.get_document(main.schema, query_hash(QUERY))
+    assert document is not None
+    assert document.document_string == QUERY
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user", "allowlisted_queries")
+async def test_allowlisted_queries(user):
+    response = await post({"extensions": persisted_query(QUERY)}, user)
+    assert response.json()["data"] == {"events": {"edges": []}}
+
+    other = "{ events(first: 2) { edges { node { id } } } }"
+    for data in (
+        {"query": QUERY},
+        {"extensions": persisted_query(other)},
+        {"query": other, "extensions": persisted_query(other)},
+    ):
+        response = await post(data, user)
+        errors = response.json()["errors"]
+        assert errors[0]["extensions"]["code"] == "OPERATION_NOT_ALLOWED"
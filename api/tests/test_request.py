@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from tests.utils import post
+
+QUERY = "{ events { totalCount } }"
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_graphql_body(user):
+    response = await post(
+        None, user, content=QUERY, headers={"Content-Type": "application/graphql"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"data": {"events": {"totalCount": 0}}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_query_string(user):
+    query = "query Events($first: Int) { events(first: $first) { totalCount } }"
+    params = {"query": query, "variables": json.dumps({"first": 1})}
+    response = await post(None, user, params=params)
+    assert response.status_code == 200
+    assert response.json() == {"data": {"events": {"totalCount": 0}}}
+
+    response = await post(None, user, params={"query": query, "variables": "{"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_invalid_body(user):
+    response = await post(
+        None, user, content="{", headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 400
+
+    response = await post(
+        None, user, content=QUERY, headers={"Content-Type": "text/plain"}
+    )
+    assert response.status_code == 415
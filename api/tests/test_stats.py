@@ -0,0 +1,23 @@
+import pytest
+from asgi_lifespan import LifespanManager
+from httpx import AsyncClient
+
+from main import app
+from tests.utils import graphql
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_pool_stats(user):
+    await graphql("{ events { edges { node { id } } } }", creadentials=user)
+
+    async with AsyncClient(
+        app=app, base_url="http://localhost:8000"
+    ) as ac, LifespanManager(app):
+        response = await ac.get("/stats")
+
+    assert response.status_code == 200
+    pool = response.json()["pool"]
+    assert pool["checkouts"] > 0
+    assert pool["checked_out"] == 0
+    assert pool["idle"] == pool["open"]
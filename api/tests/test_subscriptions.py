@@ -0,0 +1,241 @@
+import asyncio
+import uuid
+
+import pytest
+import pytz
+from jose import jwt
+from pymongo.errors import OperationFailure
+
+import main
+from changes import ChangeFeed, Subscriber, SubscriberOverflow
+from subscriptions import serve_subscriptions
+
+BBOX = {"west": -10, "south": -10, "east": 10, "north": 10}
+
+
+class ChangeStream:
+    """In-memory stand-in of the change stream which yields the changes."""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def __aiter__(self):
+        while True:
+            yield await self.changes.get()
+
+
+class Collection:
+    def __init__(self):
+        self.changes = asyncio.Queue()
+        self.resume_tokens = []
+
+    def watch(self, *args, resume_after=None, **kwargs):
+        self.resume_tokens.append(resume_after)
+        return ChangeStream(self.changes)
+
+
+class WebSocket:
+    """In-memory stand-in of the websocket, the client sends messages to it."""
+
+    def __init__(self, messages):
+        self.received = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        for message in messages:
+            self.received.put_nowait(message)
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000):
+        self.sent.put_nowait({"type": "close", "code": code})
+
+    async def receive_json(self):
+        return await self.received.get()
+
+    async def send_json(self, data):
+        self.sent.put_nowait(data)
+
+
+def change(operation, key, longitude=0, latitude=0, event_type=1):
+    event_id = uuid.UUID(int=key)
+    doc = {
+        "_id": key,
+        "id": event_id,
+        "event_type": event_type,
+        "address": f"address-{key}",
+        "location": {"type": "Point", "coordinates": [longitude, latitude]},
+    }
+    return {
+        "_id": {"_data": str(key)},
+        "operationType": operation,
+        "documentKey": {"_id": key},
+        "fullDocument": doc if operation != "delete" else None,
+    }
+
+
+@pytest.mark.asyncio
+async def test_subscriber_coalesces_changes():
+    subscriber = Subscriber(BBOX, maxsize=2)
+    subscriber.put(1, "first")
+    subscriber.put(2, "second")
+    subscriber.put(1, "first updated")
+    assert [await subscriber.__anext__() for _ in range(2)] == [
+        "second",
+        "first updated",
+    ]
+
+    for key in range(3):
+        subscriber.put(key, key)
+    with pytest.raises(SubscriberOverflow):
+        await subscriber.__anext__()
+
+
+@pytest.mark.asyncio
+async def test_change_feed():
+    collection = Collection()
+    feed = ChangeFeed(collection)
+    changes = feed.subscribe(BBOX, event_types=[1])
+
+    collection.changes.put_nowait(change("insert", 1, longitude=50))
+    collection.changes.put_nowait(change("insert", 2, event_type=2))
+    collection.changes.put_nowait(change("insert", 3))
+    collection.changes.put_nowait(change("update", 3, longitude=50))
+    collection.changes.put_nowait(change("delete", 3))
+    collection.changes.put_nowait(change("delete", 1))
+    collection.changes.put_nowait(change("insert", 4))
+
+    # pending changes are coalesced by event id, the event which left the box
+    # is delivered with update, its delete and changes outside are not
+    received = [await changes.__anext__() for _ in range(2)]
+    assert [(item["operation"], item["id"].int) for item in received] == [
+        ("update", 3),
+        ("insert", 4),
+    ]
+    await changes.aclose()
+    assert feed._task is None
+
+    # the feed restarts from current changes after the last subscriber left
+    changes = feed.subscribe(BBOX)
+    collection.changes.put_nowait(change("insert", 5))
+    assert (await changes.__anext__())["id"].int == 5
+    assert collection.resume_tokens == [None, None]
+    await changes.aclose()
+
+
+@pytest.mark.asyncio
+async def test_change_feed_operation_failure():
+    class FailingCollection(Collection):
+        def watch(self, *args, **kwargs):
+            super().watch(*args, **kwargs)
+            raise OperationFailure("Resume token history is lost")
+
+    collection = FailingCollection()
+    feed = ChangeFeed(collection)
+    feed._resume_token = {"_data": "1"}
+    changes = feed.subscribe(BBOX)
+    with pytest.raises(OperationFailure):
+        await changes.__anext__()
+    assert feed._resume_token is None
+
+
+@pytest.mark.asyncio
+async def test_change_feed_unknown_location():
+    collection = Collection()
+    feed = ChangeFeed(collection)
+    changes = feed.subscribe(BBOX, event_types=[1])
+
+    # events which existed before the feed started are stored with id as _id
+    deleted = change("delete", 1)
+    deleted["documentKey"]["_id"] = uuid.UUID(int=1)
+    collection.changes.put_nowait(deleted)
+    collection.changes.put_nowait(change("update", 2, longitude=50))
+    collection.changes.put_nowait(change("update", 3, longitude=50, event_type=2))
+    collection.changes.put_nowait(change("update", 4, longitude=5))
+    # the known location outside of the box is not delivered again
+    collection.changes.put_nowait(change("update", 2, longitude=60))
+    collection.changes.put_nowait(change("insert", 5))
+
+    received = [await changes.__anext__() for _ in range(4)]
+    assert [(item["operation"], item["id"].int) for item in received] == [
+        ("delete", 1),
+        ("update", 2),
+        ("update", 4),
+        ("insert", 5),
+    ]
+    # updates outside of the box are delivered without the document
+    assert received[0]["document"] is None
+    assert received[1]["document"] is None
+    assert received[2]["document"]["location"]["coordinates"] == [5, 0]
+    await changes.aclose()
+    assert len(feed._locations) == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("user")
+async def test_serve_subscriptions(user, monkeypatch):
+    collection = Collection()
+    monkeypatch.setattr(main, "token_cache", main.TokenCache(10, 0))
+    token = jwt.encode({**user, "exp": 2**32}, main.SECRET_KEY, algorithm="HS256")
+    query = """
+        subscription eventChanged($bbox: BoundingBoxInput!) {
+            eventChanged(bbox: $bbox) {
+                operation
+                event {
+                    address
+                }
+            }
+        }
+    """
+    websocket = WebSocket(
+        [
+            {
+                "type": "connection_init",
+                "payload": {"authorization": f"Bearer {token}"},
+            },
+            {
+                "type": "start",
+                "id": "1",
+                "payload": {"query": query, "variables": {"bbox": BBOX}},
+            },
+        ]
+    )
+    context = {"timezone": pytz.utc, "changes": ChangeFeed(collection)}
+    task = asyncio.ensure_future(
+        serve_subscriptions(websocket, main.schema, main.authenticate, context)
+    )
+    assert await websocket.sent.get() == {"type": "connection_ack"}
+
+    collection.changes.put_nowait(change("insert", 1, longitude=50))
+    collection.changes.put_nowait(change("insert", 2))
+    message = await asyncio.wait_for(websocket.sent.get(), 1)
+    assert message == {
+        "type": "data",
+        "id": "1",
+        "payload": {
+            "data": {
+                "eventChanged": {
+                    "operation": "INSERT",
+                    "event": {"address": "address-2"},
+                }
+            }
+        },
+    }
+
+    websocket.received.put_nowait({"type": "connection_terminate"})
+    await asyncio.wait_for(task, 1)
+
+
+@pytest.mark.asyncio
+async def test_serve_subscriptions_unauthorized():
+    websocket = WebSocket(
+        [{"type": "connection_init", "payload": {"authorization": "Bearer token"}}]
+    )
+    await serve_subscriptions(websocket, main.schema, main.authenticate, {})
+    assert (await websocket.sent.get())["type"] == "connection_error"
+    assert await websocket.sent.get() == {"type": "close", "code": 4401}
@@ -8,7 +8,12 @@ from jose import jwt
 from main import AUTH_EXPIRATION_MINUTES, SECRET_KEY, app
 
 
-async def graphql(query: str, creadentials: Optional[Dict] = None, **kwargs):
+async def post(
+    data=None,
+    creadentials: Optional[Dict] = None,
+    cookies: Optional[Dict] = None,
+    **options,
+):
     headers = {}
     if creadentials is not None:
         payload = creadentials.copy()
@@ -20,6 +25,13 @@ async def graphql(query: str, creadentials: Optional[Dict] = None, **kwargs):
     async with AsyncClient(
         app=app,
         headers=headers,
+        cookies=cookies,
         base_url="http://localhost:8000",
     ) as ac, LifespanManager(app):
-        return await ac.post("/", json={"query": query, "variables": kwargs})
+        if data is not None:
+            options["json"] = data
+        return await ac.post("/", **options)
+
+
+async def graphql(query: str, creadentials: Optional[Dict] = None, **kwargs):
+    return await post({"query": query, "variables": kwargs}, creadentials)
@@ -0,0 +1,139 @@
+import logging
+import uuid
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from filters import message_filter, message_sort
+
+MESSAGES_INDEXES = [
+    IndexModel([('id', ASCENDING)], name='id', unique=True),
+    # id after created lets the index serve the (created, id) sort of the list
+    IndexModel(
+        [('event', ASCENDING), ('parent', ASCENDING), ('created', ASCENDING), ('id', ASCENDING)],
+        name='event_parent_created'
+    ),
+    # serves the (created, id) sort of the list without a parent match, which
+    # event_parent_created cannot as parent precedes created in its key
+    IndexModel([('event', ASCENDING), ('created', ASCENDING), ('id', ASCENDING)], name='event_created'),
+    # replies lookup of the thread, whose event is not known
+    IndexModel([('parent', ASCENDING)], name='parent'),
+]
+
+
+def index_options(info):
+    return bool(info.get('unique', False)), bool(info.get('sparse', False))
+
+
+# code of the error of a missing index
+INDEX_NOT_FOUND = 27
+
+logger = logging.getLogger(__name__)
+
+
+async def drop_index(collection, name):
+    """Drop index of the collection, which may be dropped by another worker."""
+    try:
+        await collection.drop_index(name)
+    except OperationFailure as err:
+        if err.code != INDEX_NOT_FOUND:
+            raise
+
+
+def log_index_failure(task):
+    """Log failure of the background index build task."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Index build failed', exc_info=task.exception())
+
+
+async def reconcile_indexes(collection, indexes, background=False):
+    """
+    Create declared indexes of the collection which do not exist yet.
+
+    Existing indexes with the declared name or key and other options are
+    dropped and built again, undeclared indexes are kept.
+
+    Args:
+        collection (AsyncIOMotorCollection): indexed collection
+        indexes (list): declared IndexModel of the collection
+        background (bool): build indexes without blocking the collection
+
+    Returns:
+        list: names of built indexes
+    """
+    existing = await collection.index_information()
+    missing = []
+    for index in indexes:
+        document = index.document
+        name, key = document['name'], list(document['key'].items())
+        info = existing.get(name)
+        if (
+            info is not None
+            and list(info['key']) == key
+            and index_options(info) == index_options(document)
+        ):
+            continue
+        for existing_name, info in existing.items():
+            if existing_name == name or list(info['key']) == key:
+                await drop_index(collection, existing_name)
+        options = {option: value for option, value in document.items() if option != 'key'}
+        if background:
+            options['background'] = True
+        missing.append(IndexModel(key, **options))
+    if missing:
+        await collection.create_indexes(missing)
+    return [index.document['name'] for index in missing]
+
+
+def collection_scans(explain):
+    """
+    Find collection scans in winning plans of the explain output.
+
+    Args:
+        explain (dict): output of find or aggregate explain
+
+    Returns:
+        list: COLLSCAN stages of the winning plans
+    """
+    scans = []
+
+    def walk(value, winning):
+        if isinstance(value, dict):
+            if winning and value.get('stage') == 'COLLSCAN':
+                scans.append(value)
+            for key, item in value.items():
+                if key != 'rejectedPlans':
+                    walk(item, winning or key == 'winningPlan')
+        elif isinstance(value, list):
+            for item in value:
+                walk(item, winning)
+
+    walk(explain, False)
+    return scans
+
+
+async def ensure_indexes(db, background=False):
+    """Reconcile indexes required by the messages queries."""
+    return await reconcile_indexes(db.messages, MESSAGES_INDEXES, background)
+
+
+async def check_indexes(db):
+    """Explain canonical messages queries and fail if any of them scans the collection."""
+    event = uuid.UUID(int=0)
+    queries = {
+        'message by id': db.messages.find({'id': event}),
+        'event messages': db.messages.find(message_filter(event), sort=message_sort()),
+        'event root messages': db.messages.find(
+            message_filter(event, is_root=True), sort=message_sort()
+        ),
+        'event replies': db.messages.find(
+            message_filter(event, parent=[event]), sort=message_sort()
+        ),
+        'message replies': db.messages.find({'parent': {'$in': [event]}}),
+    }
+    failed = []
+    for name, cursor in queries.items():
+        if collection_scans(await cursor.explain()):
+            failed.append(name)
+    if failed:
+        raise Exception(f'Queries scan the messages collection: {", ".join(failed)}')
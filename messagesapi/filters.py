@@ -0,0 +1,56 @@
+MESSAGES_SORT_FIELDS = ('created', 'id')
+
+
+def message_filter(event, is_root=None, parent=None, user=None, after=None):
+    """
+    One query of the event messages with all predicates of the list.
+
+    Predicates follow the (event, parent, created, id) index, so equality on
+    the event and parent is its prefix and created and id are left for the
+    sort and the cursor.
+
+    Args:
+        event (uuid.UUID): id of the event
+        is_root (bool): only root messages if True and only replies if False
+        parent (list): ids of parent messages
+        user (list): ids of message users
+        after (dict): predicate of the messages after the cursor
+
+    Returns:
+        dict: query of find or the leading $match
+    """
+    query = {'event': event}
+    if is_root is True and not parent:
+        query['parent'] = None
+    else:
+        predicate = {}
+        if is_root is not None:
+            predicate['$eq' if is_root else '$ne'] = None
+        if parent:
+            predicate['$in'] = parent
+        if predicate:
+            query['parent'] = predicate
+    if user:
+        query['user.id'] = {'$in': user}
+    if after is not None:
+        query.update(after)
+    return query
+
+
+def message_sort(order=1):
+    """Sort of the messages which is served by the index after its equality prefix."""
+    return [(field, order) for field in MESSAGES_SORT_FIELDS]
+
+
+def message_pipeline(query, sort=None, limit=None, *stages):
+    """
+    Aggregation of the messages with one leading $match.
+
+    Use find with query, sort and limit when no other stages are needed.
+    """
+    pipeline = [{'$match': query}]
+    if sort is not None:
+        pipeline += [{'$sort': dict(sort)}]
+    if limit is not None:
+        pipeline += [{'$limit': limit}]
+    return pipeline + list(stages)
@@ -1,19 +1,31 @@
+import asyncio
+import base64
+import json
 import os
-import re
 import uuid
+from datetime import datetime
 from enum import Enum
 from typing import Optional, List
 
-from fastapi import FastAPI, Depends, Query, HTTPException
+from fastapi import FastAPI, Depends, Query, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel
 
-from models import Message, MessageCreate, MessageUpdate, User
+from database import check_indexes, ensure_indexes, log_index_failure
+from models import Message, MessageCreate, MessageThread, MessageUpdate, User
+from filters import message_filter, message_sort
+from threads import assemble_tree, thread_pipeline
 
+MESSAGES_MAX_LIMIT = int(os.getenv('MESSAGES_MAX_LIMIT', 1000))
+MESSAGES_BATCH_SIZE = int(os.getenv('MESSAGES_BATCH_SIZE', 100))
+MESSAGES_THREAD_MAX_DEPTH = int(os.getenv('MESSAGES_THREAD_MAX_DEPTH', 10))
+MESSAGES_THREAD_MAX_LIMIT = int(os.getenv('MESSAGES_THREAD_MAX_LIMIT', 100))
 
 app = FastAPI()
 
 client: AsyncIOMotorClient = None
+indexes_task: asyncio.Task = None
 
 
 async def get_client():
@@ -22,10 +34,19 @@ async def get_client():
 
 @app.on_event('startup')
 async def startup():
-    global client
+    global client, indexes_task
     DATABASE_HOST = os.getenv('DATABASE_HOST', 'localhost')
     DATABASE_PORT = os.getenv('DATABASE_PORT', 27017)
     client = AsyncIOMotorClient(DATABASE_HOST, DATABASE_PORT, uuidRepresentation='standard')
+    DATABASE_INDEXES_BACKGROUND = os.getenv('DATABASE_INDEXES_BACKGROUND', 'False').lower() == 'true'
+    DATABASE_INDEXES_CHECK = os.getenv('DATABASE_INDEXES_CHECK', 'False').lower() == 'true'
+    if DATABASE_INDEXES_BACKGROUND and not DATABASE_INDEXES_CHECK:
+        indexes_task = asyncio.ensure_future(ensure_indexes(client.messages, background=True))
+        indexes_task.add_done_callback(log_index_failure)
+        return
+    await ensure_indexes(client.messages, background=DATABASE_INDEXES_BACKGROUND)
+    if DATABASE_INDEXES_CHECK:
+        await check_indexes(client.messages)
 
 
 @app.on_event('shutdown')
@@ -40,55 +61,131 @@ async def get_user():
     )
 
 
-def ignoremptypipes(*pipelines):
-    def get_pipeline_value(pipeline):
-        for key, value in pipeline.items():
-            if isinstance(value, dict):
-                value = get_pipeline_value(value)
-            return value
+class SortingOrder(str, Enum):
+    ASC = 'asc'
+    DESC = 'desc'
 
-    for pipeline in pipelines:
-        value = get_pipeline_value(pipeline)
-        if value is not None:
-            if isinstance(value, re.Pattern) and value.pattern == '.*None.*':
-                continue
-            yield pipeline
 
+def encode_cursor(doc):
+    """Opaque cursor of the message position in (created, id) order."""
+    value = json.dumps([doc['created'].isoformat(), str(doc['id'])])
+    return base64.urlsafe_b64encode(value.encode()).decode()
 
-class SortingField(str, Enum):
-    CREATED = 'created'
 
+def decode_cursor(cursor):
+    try:
+        created, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created), uuid.UUID(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Cursor is not valid')
 
-class SortingOrder(str, Enum):
-    ASC = 'asc'
-    DESC = 'desc'
+
+def after_cursor(cursor, order):
+    """Predicate of the messages after the cursor in (created, id) order."""
+    created, id = decode_cursor(cursor)
+    operator = '$gt' if order == 1 else '$lt'
+    return {'$or': [
+        {'created': {operator: created}},
+        {'created': created, 'id': {operator: id}},
+    ]}
+
+
+async def stream_messages(cursor):
+    async for doc in cursor:
+        yield Message(**doc).json() + '\n'
 
 
 @app.get('/events/{pk}/messages', response_model=List[Message])
 async def list_messages(
         pk: uuid.UUID,
+        response: Response,
         is_root: Optional[bool] = None,
         parent: Optional[List[uuid.UUID]] = Query(None),
         user: Optional[List[uuid.UUID]] = Query(None),
-        sort_by: Optional[SortingField] = None,
         sort_order: SortingOrder = SortingOrder.ASC,
+        limit: Optional[int] = Query(None, gt=0, le=MESSAGES_MAX_LIMIT),
+        cursor: Optional[str] = None,
+        stream: bool = False,
+        batch_size: int = Query(MESSAGES_BATCH_SIZE, gt=0),
         client: AsyncIOMotorClient = Depends(get_client)
 ):
-    pipelines = []
-    if is_root is not None:
-        pipelines = [{'$match': {'parent': None if is_root else {'$ne': None}}}]
-    pipelines += list(
-        ignoremptypipes(
-            {'$match': {'event': pk}},
-            {'$match': {'parent': {'$in': parent}}},
-            {'$match': {'user.id': {'$in': user}}}
-        ),
+    """
+    Messages of the event in (created, id) order.
+
+    Next page of the limited list starts after the X-Next-Cursor response
+    header. With stream messages are written as NDJSON while the cursor
+    yields batches of batch_size documents.
+    """
+    order = 1 if sort_order == SortingOrder.ASC else -1
+    query = message_filter(
+        pk,
+        is_root=is_root,
+        parent=parent,
+        user=user,
+        after=after_cursor(cursor, order) if cursor is not None else None
     )
-    if sort_by is not None:
-        order = 1 if sort_order == SortingOrder.ASC else -1
-        pipelines += [{'$sort': {sort_by.value: order}}]
-    collectiion = client.messages.messages.aggregate(pipelines)
-    return [Message(**doc) async for doc in collectiion]
+    # one more message tells whether there is a next page
+    limit_docs = limit if stream or limit is None else limit + 1
+    collectiion = client.messages.messages.find(
+        query, sort=message_sort(order), limit=limit_docs or 0, batch_size=batch_size
+    )
+
+    if stream:
+        return StreamingResponse(
+            stream_messages(collectiion), media_type='application/x-ndjson'
+        )
+    docs = await collectiion.to_list(None)
+    if limit is not None and len(docs) > limit:
+        docs = docs[:limit]
+        response.headers['X-Next-Cursor'] = encode_cursor(docs[-1])
+    return [Message(**doc) for doc in docs]
+
+
+@app.get('/events/{pk}/threads', response_model=List[MessageThread])
+async def list_threads(
+        pk: uuid.UUID,
+        max_depth: int = Query(MESSAGES_THREAD_MAX_DEPTH, ge=0, le=MESSAGES_THREAD_MAX_DEPTH),
+        limit: int = Query(MESSAGES_THREAD_MAX_LIMIT, gt=0, le=MESSAGES_THREAD_MAX_LIMIT),
+        client: AsyncIOMotorClient = Depends(get_client)
+):
+    """
+    Root messages of the event with replies.
+
+    limit bounds the roots and the replies of every message separately. The
+    whole subtree of each root is loaded before replies are limited, so large
+    threads may exceed the 16MB document or 100MB $graphLookup memory limits.
+    """
+    pipeline = thread_pipeline(
+        message_filter(pk, is_root=True),
+        max_depth,
+        restrict={'event': pk},
+        sort=message_sort(),
+        limit=limit
+    )
+    docs = client.messages.messages.aggregate(pipeline)
+    return [MessageThread(**assemble_tree(doc, limit)) async for doc in docs]
+
+
+@app.get('/messages/{pk}/thread', response_model=MessageThread)
+async def retrieve_thread(
+        pk: uuid.UUID,
+        max_depth: int = Query(MESSAGES_THREAD_MAX_DEPTH, ge=0, le=MESSAGES_THREAD_MAX_DEPTH),
+        limit: int = Query(MESSAGES_THREAD_MAX_LIMIT, gt=0, le=MESSAGES_THREAD_MAX_LIMIT),
+        client: AsyncIOMotorClient = Depends(get_client)
+):
+    """
+    Message with replies.
+
+    limit bounds the replies of every message separately. The whole subtree is
+    loaded before replies are limited, so large threads may exceed the 16MB
+    document or 100MB $graphLookup memory limits.
+    """
+    docs = await client.messages.messages.aggregate(
+        thread_pipeline({'id': pk}, max_depth)
+    ).to_list(None)
+    if not docs:
+        raise HTTPException(status_code=404, detail='Message not found')
+    return MessageThread(**assemble_tree(docs[0], limit))
 
 
 @app.post('/events/{pk}/messages', response_model=Message)
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -22,6 +22,13 @@ class Message(BaseModel):
     changed: datetime = Field(default_factory=datetime.now)
 
 
+class MessageThread(Message):
+    replies: List['MessageThread'] = []
+
+
+MessageThread.update_forward_refs()
+
+
 class MessageCreate(BaseModel):
     body: str
     parent: Optional[uuid.UUID]
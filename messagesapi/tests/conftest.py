@@ -0,0 +1,32 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import main
+from database import ensure_indexes
+
+
+@pytest.fixture
+async def db():
+    client = AsyncIOMotorClient(
+        os.getenv('DATABASE_HOST', 'localhost'),
+        int(os.getenv('DATABASE_PORT', 27017)),
+        uuidRepresentation='standard'
+    )
+    db = client.test_messages
+    await ensure_indexes(db)
+    yield db
+    await client.drop_database('test_messages')
+    client.close()
+
+
+@pytest.fixture
+async def api(db):
+    """Client of the service whose endpoints use the test database."""
+    main.app.dependency_overrides[main.get_client] = lambda: SimpleNamespace(messages=db)
+    async with AsyncClient(app=main.app, base_url='http://localhost:8000') as client:
+        yield client
+    main.app.dependency_overrides.clear()
@@ -0,0 +1,107 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from filters import message_filter, message_pipeline, message_sort
+
+EVENT = uuid.UUID(int=1)
+PARENT = uuid.UUID(int=2)
+USER = uuid.UUID(int=3)
+
+
+def plan_stages(explain):
+    """Stage names of the winning plan of find or aggregate explain."""
+    stages = []
+
+    def walk(value, winning):
+        if isinstance(value, dict):
+            if winning and 'stage' in value:
+                stages.append(value['stage'])
+            for key, item in value.items():
+                if key != 'rejectedPlans':
+                    walk(item, winning or key == 'winningPlan')
+        elif isinstance(value, list):
+            for item in value:
+                walk(item, winning)
+
+    walk(explain, False)
+    return stages
+
+
+@pytest.fixture
+async def messages(db):
+    created = datetime(2021, 1, 1)
+    docs = []
+    for index in range(20):
+        docs.append({
+            'id': uuid.uuid4(),
+            'body': f'message {index}',
+            'event': EVENT if index % 2 else uuid.uuid4(),
+            'parent': PARENT if index % 3 else None,
+            'user': {'id': USER if index % 4 else uuid.uuid4(), 'name': 'user'},
+            'created': created + timedelta(minutes=index),
+            'changed': created,
+        })
+    await db.messages.insert_many(docs)
+    return db.messages
+
+
+def test_message_filter():
+    assert message_filter(EVENT) == {'event': EVENT}
+    assert message_filter(EVENT, is_root=True) == {'event': EVENT, 'parent': None}
+    assert message_filter(EVENT, is_root=False, parent=[PARENT], user=[USER]) == {
+        'event': EVENT,
+        'parent': {'$ne': None, '$in': [PARENT]},
+        'user.id': {'$in': [USER]},
+    }
+
+
+def test_message_pipeline():
+    query = message_filter(EVENT, is_root=True)
+    pipeline = message_pipeline(query, message_sort(-1), 10)
+    assert pipeline == [
+        {'$match': {'event': EVENT, 'parent': None}},
+        {'$sort': {'created': -1, 'id': -1}},
+        {'$limit': 10},
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('options', [
+    {'is_root': True},
+    {'parent': [PARENT]},
+    {'is_root': False, 'user': [USER]},
+])
+async def test_find_uses_index(messages, options):
+    cursor = messages.find(message_filter(EVENT, **options), sort=message_sort())
+    stages = plan_stages(await cursor.explain())
+    assert 'IXSCAN' in stages
+    assert 'COLLSCAN' not in stages
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('order', [1, -1])
+async def test_index_serves_sort(messages, order):
+    query = message_filter(EVENT, is_root=True)
+    stages = plan_stages(await messages.find(query, sort=message_sort(order)).explain())
+    assert 'IXSCAN' in stages
+    assert 'SORT' not in stages
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('order', [1, -1])
+async def test_index_serves_unfiltered_sort(messages, order):
+    cursor = messages.find(message_filter(EVENT), sort=message_sort(order), limit=5)
+    stages = plan_stages(await cursor.explain())
+    assert 'IXSCAN' in stages
+    assert 'SORT' not in stages
+
+
+@pytest.mark.asyncio
+async def test_pipeline_uses_index(messages, db):
+    pipeline = message_pipeline(message_filter(EVENT, parent=[PARENT]), message_sort(), 5)
+    explain = await db.command('aggregate', 'messages', pipeline=pipeline, explain=True)
+    stages = plan_stages(explain)
+    assert 'IXSCAN' in stages
+    assert 'COLLSCAN' not in stages
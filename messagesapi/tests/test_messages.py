@@ -0,0 +1,62 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+EVENT = uuid.UUID(int=1)
+
+
+@pytest.fixture
+async def messages(db):
+    created = datetime(2021, 1, 1)
+    docs = [
+        {
+            'id': uuid.uuid4(),
+            'body': f'message {index}',
+            'event': EVENT,
+            'parent': None,
+            'user': {'id': uuid.uuid4(), 'name': 'user'},
+            # pairs of messages are created at the same time
+            'created': created + timedelta(minutes=index // 2),
+            'changed': created,
+        }
+        for index in range(7)
+    ]
+    await db.messages.insert_many([doc.copy() for doc in docs])
+    return sorted(docs, key=lambda doc: (doc['created'], doc['id'].bytes))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+async def test_list_messages_cursor(api, messages, sort_order):
+    bodies, params = [], {'limit': 3, 'sort_order': sort_order}
+    while True:
+        response = await api.get(f'/events/{EVENT}/messages', params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 3
+        bodies += [message['body'] for message in response.json()]
+        if 'X-Next-Cursor' not in response.headers:
+            break
+        params['cursor'] = response.headers['X-Next-Cursor']
+
+    expected = [doc['body'] for doc in messages]
+    assert bodies == (expected if sort_order == 'asc' else expected[::-1])
+
+
+@pytest.mark.asyncio
+async def test_list_messages_invalid_cursor(api):
+    response = await api.get(f'/events/{EVENT}/messages', params={'cursor': 'cursor'})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_list_messages_stream(api, messages):
+    params = {'stream': True, 'batch_size': 2, 'limit': 5}
+    response = await api.get(f'/events/{EVENT}/messages', params=params)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    lines = response.text.splitlines()
+    assert [json.loads(line)['body'] for line in lines] == [
+        doc['body'] for doc in messages[:5]
+    ]
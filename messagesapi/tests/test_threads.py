@@ -0,0 +1,163 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from threads import assemble_tree, replies_lookup
+
+ROOT = uuid.UUID(int=1)
+CREATED = datetime(2021, 1, 1)
+
+
+def reply(pk, parent, depth, minutes):
+    return {
+        'id': uuid.UUID(int=pk),
+        'parent': uuid.UUID(int=parent),
+        'depth': depth,
+        'created': CREATED + timedelta(minutes=minutes),
+    }
+
+
+def ids(messages):
+    return [message['id'].int for message in messages]
+
+
+def tree_ids(message):
+    return [pk for child in message['replies'] for pk in [child['id'].int, *tree_ids(child)]]
+
+
+def test_replies_lookup():
+    stage = replies_lookup(3, {'event': ROOT})['$graphLookup']
+    assert stage['maxDepth'] == 2
+    assert stage['restrictSearchWithMatch'] == {'event': ROOT}
+    assert 'restrictSearchWithMatch' not in replies_lookup(1)['$graphLookup']
+
+
+def test_assemble_tree_order():
+    # flat replies come in no particular order, deeper ones before parents
+    doc = {'id': ROOT, 'replies': [
+        reply(5, 3, 1, 1),
+        reply(4, 2, 1, 0),
+        reply(3, 1, 0, 2),
+        reply(6, 2, 1, 0),
+        reply(2, 1, 0, 1),
+    ]}
+    tree = assemble_tree(doc)
+    assert ids(tree['replies']) == [2, 3]
+    assert ids(tree['replies'][0]['replies']) == [4, 6]
+    assert ids(tree['replies'][1]['replies']) == [5]
+    assert tree['replies'][1]['replies'][0]['replies'] == []
+
+
+def test_assemble_tree_limit():
+    doc = {'id': ROOT, 'replies': [
+        reply(2, 1, 0, 0),
+        reply(3, 1, 0, 1),
+        reply(4, 1, 0, 2),
+        reply(5, 2, 1, 0),
+        reply(6, 2, 1, 1),
+        reply(7, 2, 1, 2),
+    ]}
+    tree = assemble_tree(doc, limit=2)
+    # the limit applies to the replies of every message separately
+    assert ids(tree['replies']) == [2, 3]
+    assert ids(tree['replies'][0]['replies']) == [5, 6]
+
+
+def test_assemble_tree_drops_subtree():
+    doc = {'id': ROOT, 'replies': [
+        reply(2, 1, 0, 0),
+        reply(3, 1, 0, 1),
+        reply(4, 3, 1, 0),
+        reply(5, 4, 2, 0),
+        reply(6, 2, 1, 0),
+    ]}
+    tree = assemble_tree(doc, limit=1)
+    assert ids(tree['replies']) == [2]
+    assert ids(tree['replies'][0]['replies']) == [6]
+    # 4 and 5 are dropped with their parent 3 over the limit of the root
+    assert tree_ids(tree) == [2, 6]
+
+
+def test_assemble_tree_without_replies():
+    tree = assemble_tree({'id': ROOT})
+    assert tree['replies'] == []
+
+
+@pytest.fixture
+async def thread(db):
+    docs = []
+
+    def message(body, parent=None, event=ROOT, minutes=0):
+        doc = {
+            'id': uuid.uuid4(),
+            'body': body,
+            'event': event,
+            'parent': parent and parent['id'],
+            'user': {'id': uuid.uuid4(), 'name': 'user'},
+            'created': CREATED + timedelta(minutes=minutes),
+            'changed': CREATED,
+        }
+        docs.append(doc)
+        return doc
+
+    first = message('first')
+    message('second', minutes=1)
+    reply = message('reply', first, minutes=1)
+    message('other reply', first, minutes=2)
+    nested = message('nested', reply, minutes=3)
+    message('deep', nested, minutes=4)
+    # reply of the message which is posted to another event
+    message('foreign', first, event=uuid.uuid4(), minutes=5)
+    await db.messages.insert_many([doc.copy() for doc in docs])
+    return first
+
+
+def bodies(message):
+    return [(reply['body'], bodies(reply)) for reply in message['replies']]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_thread(api, thread):
+    response = await api.get(f'/messages/{thread["id"]}/thread')
+    assert response.status_code == 200
+    assert bodies(response.json()) == [
+        ('reply', [('nested', [('deep', [])])]),
+        ('other reply', []),
+        ('foreign', []),
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('max_depth, expected', [
+    (0, []),
+    (1, [('reply', []), ('other reply', []), ('foreign', [])]),
+])
+async def test_retrieve_thread_max_depth(api, thread, max_depth, expected):
+    response = await api.get(f'/messages/{thread["id"]}/thread', params={'max_depth': max_depth})
+    assert response.status_code == 200
+    assert bodies(response.json()) == expected
+
+
+@pytest.mark.asyncio
+async def test_retrieve_thread_not_found(api):
+    response = await api.get(f'/messages/{uuid.uuid4()}/thread')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_list_threads(api, thread):
+    response = await api.get(f'/events/{ROOT}/threads')
+    assert response.status_code == 200
+    # replies of the thread are restricted to the event
+    assert [(root['body'], bodies(root)) for root in response.json()] == [
+        ('first', [('reply', [('nested', [('deep', [])])]), ('other reply', [])]),
+        ('second', []),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_list_threads_limit(api, thread):
+    response = await api.get(f'/events/{ROOT}/threads', params={'max_depth': 0, 'limit': 1})
+    assert response.status_code == 200
+    assert [(root['body'], bodies(root)) for root in response.json()] == [('first', [])]
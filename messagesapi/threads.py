@@ -0,0 +1,79 @@
+from filters import message_pipeline
+
+
+def replies_lookup(max_depth, restrict=None):
+    """
+    $graphLookup stage of the replies of the message up to max_depth levels.
+
+    Args:
+        max_depth (int): number of reply levels, at least 1
+        restrict (dict): match of the looked up replies, e.g. event of the thread
+
+    Returns:
+        dict: stage which adds replies with their depth, 0 for direct replies
+    """
+    lookup = {
+        'from': 'messages',
+        'startWith': '$id',
+        'connectFromField': 'id',
+        'connectToField': 'parent',
+        'as': 'replies',
+        'maxDepth': max_depth - 1,
+        'depthField': 'depth',
+    }
+    if restrict is not None:
+        lookup['restrictSearchWithMatch'] = restrict
+    return {'$graphLookup': lookup}
+
+
+def thread_pipeline(query, max_depth, restrict=None, sort=None, limit=None):
+    """
+    Aggregation of the thread roots with replies of all levels.
+
+    Every root document carries its whole subtree up to max_depth, the limit
+    of replies per message is applied later by assemble_tree. A thread must
+    therefore fit the 16MB document limit and the 100MB memory limit of
+    $graphLookup, which fails the aggregation otherwise.
+
+    Args:
+        query (dict): query of the thread roots
+        max_depth (int): number of reply levels
+        restrict (dict): match of the looked up replies
+        sort (list): sort of the thread roots
+        limit (int): maximum number of the thread roots
+    """
+    stages = [replies_lookup(max_depth, restrict)] if max_depth > 0 else []
+    return message_pipeline(query, sort, limit, *stages)
+
+
+def assemble_tree(doc, limit=None):
+    """
+    Nest looked up replies of the thread root in one pass.
+
+    Replies are visited level by level in (created, id) order, so the parent
+    of every reply is placed before it. The limit applies to the replies of
+    each message separately, not to a level or the whole thread, and only
+    after all replies were loaded. Replies over the limit of their parent
+    are dropped together with their own replies.
+
+    Args:
+        doc (dict): thread root with flat replies of $graphLookup
+        limit (int): maximum number of replies of every message
+
+    Returns:
+        dict: thread root with nested replies
+    """
+    replies = sorted(
+        doc.pop('replies', []),
+        key=lambda reply: (reply['depth'], reply['created'], reply['id'].bytes)
+    )
+    doc['replies'] = []
+    nodes = {doc['id']: doc}
+    for reply in replies:
+        parent = nodes.get(reply['parent'])
+        if parent is None or (limit is not None and len(parent['replies']) >= limit):
+            continue
+        reply['replies'] = []
+        parent['replies'].append(reply)
+        nodes[reply['id']] = reply
+    return doc
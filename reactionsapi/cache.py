@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+class TTLCache:
+    """
+    Least recently used cache which expires entries after ttl seconds.
+
+    Args:
+        maxsize (int): maximum number of entries
+        ttl (float): time to live of entries in seconds
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return default
+        if expires <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class SummaryCache:
+    """
+    Cache of the event scores which is invalidated by changes of the summaries.
+
+    The worker watches the reaction_summaries collection with a change stream
+    and drops scores of events changed by all workers, its own writes drop
+    scores right away. Standalone servers have no change streams, so the ttl
+    bounds staleness of the scores written by other workers there.
+
+    Args:
+        collection: mongo motor reaction_summaries collection
+        maxsize (int): maximum number of cached scores
+        ttl (float): time to live of scores in seconds
+    """
+
+    def __init__(self, collection, maxsize=10000, ttl=60):
+        self.collection = collection
+        self.watching = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._scores = TTLCache(maxsize, ttl)
+        self._resume_token = None
+        self._task = None
+
+    async def get_or_load(self, event, load):
+        """
+        Cached score of the event or score loaded by load coroutine function.
+
+        Scores loaded while the event is invalidated are not cached, so the
+        cache never keeps a score which is older than the last change.
+
+        Returns:
+            tuple: score and whether it is cached
+        """
+        score = self._scores.get(event)
+        if score is not None:
+            self.hits += 1
+            return score, True
+        self.misses += 1
+        invalidations = self.invalidations
+        score = await load(event)
+        if invalidations == self.invalidations:
+            self._scores.set(event, score)
+        return score, False
+
+    def invalidate(self, event=None):
+        """Drop score of the event or all scores if event is None."""
+        self.invalidations += 1
+        if event is None:
+            self._scores.clear()
+        else:
+            self._scores.pop(event)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.watching = False
+
+    async def watch(self):
+        pipeline = [{'$project': {'operationType': True, 'fullDocument.event': True}}]
+        while True:
+            try:
+                async with self.collection.watch(
+                    pipeline,
+                    full_document='updateLookup',
+                    resume_after=self._resume_token
+                ) as stream:
+                    self.watching = True
+                    async for change in stream:
+                        self._resume_token = change['_id']
+                        doc = change.get('fullDocument')
+                        self.invalidate(doc['event'] if doc is not None else None)
+            except OperationFailure:
+                # e.g. change streams are not supported by standalone servers
+                self.watching = False
+                self.invalidate()
+                return
+            except PyMongoError:
+                # changes are missed until the stream is resumed
+                self.watching = False
+                self.invalidate()
+                await asyncio.sleep(1)
+
+    def as_dict(self):
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._scores),
+            'watching': self.watching,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0,
+            'invalidations': self.invalidations,
+        }
@@ -1,17 +1,38 @@
+import asyncio
 import os
 import uuid
-from datetime import datetime
 from typing import List
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Header, HTTPException, Response
 from motor.motor_asyncio import AsyncIOMotorClient
-
-from schemas import User, Reaction, ReactionCreate, ReactionType
-
+from pymongo.errors import DuplicateKeyError
+
+from cache import SummaryCache
+from database import check_indexes, ensure_indexes, log_index_failure
+from schemas import EventSummariesRequest, EventSummary, User, Reaction, ReactionCreate, ReactionType
+from summaries import (
+    SummaryWriter,
+    backfill_summaries,
+    flip_increment,
+    get_summary_score,
+    get_summary_scores,
+    get_user_reactions,
+    increment_summary,
+    reaction_increment,
+)
+
+SUMMARIES_MAX_EVENTS = int(os.getenv('SUMMARIES_MAX_EVENTS', 100))
+# seconds between flushes of coalesced summary increments, 0 writes them inline
+SUMMARIES_WRITE_BEHIND_INTERVAL = float(os.getenv('SUMMARIES_WRITE_BEHIND_INTERVAL', 0))
+SUMMARIES_CACHE_SIZE = int(os.getenv('SUMMARIES_CACHE_SIZE', 10000))
+SUMMARIES_CACHE_TTL = float(os.getenv('SUMMARIES_CACHE_TTL', 60))
 
 app = FastAPI()
 
 client: AsyncIOMotorClient = None
+indexes_task: asyncio.Task = None
+summary_writer: SummaryWriter = None
+summary_cache: SummaryCache = None
 
 
 async def get_client():
@@ -27,17 +48,53 @@ async def get_user():
 
 @app.on_event('startup')
 async def startup():
-    global client
+    global client, indexes_task, summary_writer, summary_cache
     DATABASE_HOST = os.getenv('DATABASE_HOST', 'localhost')
     DATABASE_PORT = os.getenv('DATABASE_PORT', 27017)
     client = AsyncIOMotorClient(DATABASE_HOST, DATABASE_PORT, uuidRepresentation='standard')
+    # summaries of the reactions which precede them, see the migration of summaries.py
+    if not await client.reactions.reaction_summaries.estimated_document_count():
+        await backfill_summaries(client.reactions)
+    summary_cache = SummaryCache(
+        client.reactions.reaction_summaries, SUMMARIES_CACHE_SIZE, SUMMARIES_CACHE_TTL
+    )
+    summary_cache.start()
+    if SUMMARIES_WRITE_BEHIND_INTERVAL > 0:
+        summary_writer = SummaryWriter(
+            client.reactions, SUMMARIES_WRITE_BEHIND_INTERVAL, on_flush=invalidate_summaries
+        )
+        summary_writer.start()
+    DATABASE_INDEXES_BACKGROUND = os.getenv('DATABASE_INDEXES_BACKGROUND', 'False').lower() == 'true'
+    DATABASE_INDEXES_CHECK = os.getenv('DATABASE_INDEXES_CHECK', 'False').lower() == 'true'
+    if DATABASE_INDEXES_BACKGROUND and not DATABASE_INDEXES_CHECK:
+        indexes_task = asyncio.ensure_future(ensure_indexes(client.reactions, background=True))
+        indexes_task.add_done_callback(log_index_failure)
+        return
+    await ensure_indexes(client.reactions, background=DATABASE_INDEXES_BACKGROUND)
+    if DATABASE_INDEXES_CHECK:
+        await check_indexes(client.reactions)
 
 
 @app.on_event('shutdown')
-def shutdown():
+async def shutdown():
+    if summary_writer is not None:
+        await summary_writer.stop()
+    summary_cache.stop()
     client.close()
 
 
+def invalidate_summaries(events):
+    """
+    Drop cached scores of the events written by the worker.
+
+    The change stream drops them as well, but its changes arrive after the
+    response, so reads right after a toggle would get the former score.
+    """
+    if summary_cache is not None:
+        for event in events:
+            summary_cache.invalidate(event)
+
+
 @app.get('/types', response_model=List[str])
 async def list_types():
     return list(ReactionType)
@@ -46,17 +103,62 @@ async def list_types():
 @app.get('/events/{pk}/summary', response_model=int)
 async def event_summary(
         pk: uuid.UUID,
+        response: Response,
+        x_cache_bypass: bool = Header(False),
         client: AsyncIOMotorClient = Depends(get_client)
 ):
-    positive_count = await client.reactions.reactions.count_documents({
-        'event': pk,
-        'type': ReactionType.POSITIVE.value
-    })
-    negative_count = await client.reactions.reactions.count_documents({
-        'event': pk,
-        'type': ReactionType.NEGATIVE.value
-    })
-    return positive_count - negative_count
+    if x_cache_bypass or summary_cache is None:
+        response.headers['X-Cache'] = 'BYPASS'
+        return await get_summary_score(client.reactions, pk)
+    score, cached = await summary_cache.get_or_load(
+        pk, lambda event: get_summary_score(client.reactions, event)
+    )
+    response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+    return score
+
+
+@app.get('/stats')
+async def stats():
+    return {'summaries': summary_cache.as_dict() if summary_cache is not None else None}
+
+
+@app.post('/events/summaries', response_model=List[EventSummary])
+async def event_summaries(
+        data: EventSummariesRequest,
+        user: User = Depends(get_user),
+        client: AsyncIOMotorClient = Depends(get_client)
+):
+    events = list(dict.fromkeys(data.events))
+    if len(events) > SUMMARIES_MAX_EVENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Number of events must not exceed {SUMMARIES_MAX_EVENTS}'
+        )
+    scores = await get_summary_scores(client.reactions, events)
+    reactions = {}
+    if data.include_reaction:
+        reactions = await get_user_reactions(client.reactions, events, user.id)
+    return [
+        EventSummary(event=event, score=scores.get(event, 0), reaction=reactions.get(event))
+        for event in events
+    ]
+
+
+async def upsert_reaction(collection, reaction: Reaction):
+    """Set type of the reaction of the user, returns previous type document."""
+    fields = reaction.dict()
+    return await collection.find_one_and_update(
+        {'event': reaction.event, 'user.id': reaction.user.id},
+        {
+            '$set': {'type': reaction.type.value, 'changed': reaction.changed},
+            '$setOnInsert': {
+                field: value for field, value in fields.items()
+                if field not in ('type', 'changed')
+            },
+        },
+        projection={'_id': False, 'type': True},
+        upsert=True
+    )
 
 
 @app.post('/events/{pk}/toggle', response_model=int)
@@ -66,37 +168,28 @@ async def toggle_reaction(
         user: User = Depends(get_user),
         client: AsyncIOMotorClient = Depends(get_client)
 ):
-    positive_count = await client.reactions.reactions.count_documents({
-        'event': pk,
-        'type': ReactionType.POSITIVE
-    })
-    negative_count = await client.reactions.reactions.count_documents({
-        'event': pk,
-        'type': ReactionType.NEGATIVE
-    })
-
-    summary = positive_count - negative_count
-    reaction_value = 1 if data.type == ReactionType.POSITIVE else -1
-    reaction_db = await client.reactions.reactions.find_one({
-        'event': pk,
-        'user.id': user.id
-    })
-
-    if reaction_db is None:
-        instance = Reaction(event=pk, type=data.type, user=user)
-        await client.reactions.reactions.insert_one(instance.dict())
-        return summary + reaction_value
-
-    reaction = Reaction(**reaction_db)
-    if reaction.type == data.type:
-        await client.reactions.reactions.delete_one({'id': reaction.id})
-        return summary + reaction_value * -1
+    removed = await client.reactions.reactions.find_one_and_delete(
+        {'event': pk, 'user.id': user.id, 'type': data.type.value},
+        projection={'_id': False, 'type': True}
+    )
+    if removed is not None:
+        increment = reaction_increment(data.type, -1)
     else:
-        await client.reactions.reactions.update_one(
-            {'id': reaction.id},
-            {'$set': {
-                'type': ReactionType.NEGATIVE if reaction.type == ReactionType.POSITIVE else ReactionType.POSITIVE,
-                'changed': datetime.now()
-            }}
-        )
-        return summary + reaction_value * 2
+        reaction = Reaction(event=pk, type=data.type, user=user)
+        try:
+            previous = await upsert_reaction(client.reactions.reactions, reaction)
+        except DuplicateKeyError:
+            # concurrent toggle of the user inserted the reaction first
+            previous = await upsert_reaction(client.reactions.reactions, reaction)
+        if previous is None:
+            increment = reaction_increment(data.type)
+        elif previous['type'] == data.type:
+            increment = {}
+        else:
+            increment = flip_increment(previous['type'], data.type)
+
+    if summary_writer is not None:
+        return await summary_writer.increment(pk, increment)
+    score = await increment_summary(client.reactions, pk, increment)
+    invalidate_summaries([pk])
+    return score
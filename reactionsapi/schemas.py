@@ -1,6 +1,7 @@
 import uuid
 from datetime import datetime
 from enum import Enum
+from typing import List, Optional
 
 from pydantic import Field
 from pydantic.main import BaseModel
@@ -28,3 +29,14 @@ class Reaction(BaseModel):
 
 class ReactionCreate(BaseModel):
     type: ReactionType = ReactionType.POSITIVE
+
+
+class EventSummariesRequest(BaseModel):
+    events: List[uuid.UUID]
+    include_reaction: bool = False
+
+
+class EventSummary(BaseModel):
+    event: uuid.UUID
+    score: int
+    reaction: Optional[ReactionType]
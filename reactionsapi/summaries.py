@@ -0,0 +1,438 @@
+"""
+Per-event reaction counters of the reaction_summaries collection.
+
+Counters are kept in sync by the write path of the reactions, rebuild and
+check the counters from the reactions after migrations or failed writes:
+    python summaries.py rebuild [--event <id>]
+    python summaries.py dedupe
+    python summaries.py check
+
+Migration of the deployed reactions:
+    1. python summaries.py dedupe, so the unique index of the users builds
+    2. deploy, the first worker backfills summaries while the collection is
+       empty and toggles of events without summary seed it from the reactions
+    3. python summaries.py check, and rebuild the reported events while
+       reactions are not written
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, PyMongoError
+
+from schemas import ReactionType
+
+REBUILD_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def reaction_increment(type, value=1):
+    """
+    Counters increment of the summary document for added or removed reaction.
+
+    Args:
+        type (ReactionType): type of the reaction
+        value (int): 1 for added reaction and -1 for removed one
+
+    Returns:
+        dict: $inc of the summary document
+    """
+    if type == ReactionType.POSITIVE:
+        return {'positive': value, 'score': value}
+    return {'negative': value, 'score': -value}
+
+
+def flip_increment(old_type, new_type):
+    """Counters increment of the summary document for changed reaction type."""
+    increment = reaction_increment(old_type, -1)
+    for field, value in reaction_increment(new_type).items():
+        increment[field] = increment.get(field, 0) + value
+    return increment
+
+
+async def increment_summary(db, event, increment):
+    """
+    Apply increment to the summary document of the event.
+
+    Returns:
+        int: score of the event after increment
+    """
+    if not increment:
+        return await get_summary_score(db, event)
+    doc = await db.reaction_summaries.find_one_and_update(
+        {'event': event},
+        {'$inc': increment},
+        projection={'_id': False, 'score': True},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc is not None:
+        return doc['score']
+    # reactions of the event may precede the summaries, so the missing summary
+    # is counted from the reactions, which already include the increment
+    summary = await count_summary(db, event)
+    try:
+        result = await db.reaction_summaries.update_one(
+            {'event': event}, {'$setOnInsert': summary}, upsert=True
+        )
+    except DuplicateKeyError:
+        result = None
+    if result is not None and result.upserted_id is not None:
+        return summary['score']
+    # summary of the concurrent write, which may count the reaction as well
+    doc = await db.reaction_summaries.find_one_and_update(
+        {'event': event},
+        {'$inc': increment},
+        projection={'_id': False, 'score': True},
+        return_document=ReturnDocument.AFTER
+    )
+    return doc['score']
+
+
+async def get_summary_score(db, event):
+    doc = await db.reaction_summaries.find_one(
+        {'event': event}, projection={'_id': False, 'score': True}
+    )
+    return doc['score'] if doc is not None else 0
+
+
+async def get_summary_scores(db, events):
+    """
+    Scores of the events from one lookup of the summary documents.
+
+    Returns:
+        dict: score by event id, events without reactions are missing
+    """
+    cursor = db.reaction_summaries.find(
+        {'event': {'$in': events}}, projection={'_id': False, 'event': True, 'score': True}
+    )
+    return {doc['event']: doc['score'] async for doc in cursor}
+
+
+async def get_user_reactions(db, events, user_id):
+    """
+    Reaction types of the user to the events.
+
+    Returns:
+        dict: reaction type by event id, events without reaction are missing
+    """
+    cursor = db.reactions.find(
+        {'event': {'$in': events}, 'user.id': user_id},
+        projection={'_id': False, 'event': True, 'type': True}
+    )
+    return {doc['event']: doc['type'] async for doc in cursor}
+
+
+class SummaryWriter:
+    """
+    Write-behind buffer of the summary increments.
+
+    Increments of the same event are coalesced and written by one bulk write
+    every interval, so toggles of a popular event do not contend on its
+    summary document. Scores are the stored score plus the unwritten
+    increments, read while no flush is in flight. Increments which are not
+    flushed before the worker stops are restored by the rebuild command.
+    Missing summaries are created from the increments alone, so reactions
+    which precede the summaries must be backfilled first.
+
+    Args:
+        db (AsyncIOMotorDatabase): reactions database
+        interval (float): seconds between flushes
+        on_flush: function which is called with ids of the written events
+    """
+
+    def __init__(self, db, interval=1.0, on_flush=None):
+        self.db = db
+        self.interval = interval
+        self.on_flush = on_flush
+        self._pending = {}
+        self._flushing = {}
+        # set when the increments of the started flush are written or failed
+        self._flushed = None
+        self._flushes = 0
+        self._task = None
+
+    def unwritten_score(self, event):
+        return sum(
+            increments.get(event, {}).get('score', 0)
+            for increments in (self._pending, self._flushing)
+        )
+
+    async def increment(self, event, increment):
+        """
+        Buffer increment of the event summary.
+
+        Returns:
+            int: score of the event with unwritten increments
+        """
+        pending = self._pending.setdefault(event, {})
+        for field, value in increment.items():
+            pending[field] = pending.get(field, 0) + value
+        while True:
+            # the stored score may or may not include the increments of the
+            # flush in flight, so it is read while no flush runs
+            if self._flushed is not None:
+                await self._flushed.wait()
+            flushes = self._flushes
+            score = await get_summary_score(self.db, event)
+            if flushes == self._flushes and self._flushed is None:
+                return score + self.unwritten_score(event)
+
+    def requeue(self, events):
+        for event in events:
+            pending = self._pending.setdefault(event, {})
+            for field, value in self._flushing[event].items():
+                pending[field] = pending.get(field, 0) + value
+
+    def written(self, events):
+        if self.on_flush is not None and events:
+            self.on_flush(events)
+
+    async def flush(self):
+        """
+        Write buffered increments with one unordered bulk write.
+
+        Increments of the failed writes are retried by the next flush. Writes
+        interrupted by network errors may be applied by the server, so their
+        increments are not retried and the rebuild restores the counters.
+        """
+        self._flushing, self._pending = self._pending, {}
+        self._flushes += 1
+        self._flushed = flushed = asyncio.Event()
+        events = [
+            event for event, increment in self._flushing.items()
+            if any(increment.values())
+        ]
+        requests = [
+            UpdateOne({'event': event}, {'$inc': self._flushing[event]}, upsert=True)
+            for event in events
+        ]
+        try:
+            if requests:
+                await self.db.reaction_summaries.bulk_write(requests, ordered=False)
+        except BulkWriteError as err:
+            # other writes of the unordered bulk write are applied
+            failed = {events[error['index']] for error in err.details['writeErrors']}
+            self.requeue(failed)
+            self.written([event for event in events if event not in failed])
+            raise
+        except ConnectionFailure:
+            logger.error('Summary increments of %d events may be lost', len(events))
+            self.written(events)
+            raise
+        except PyMongoError:
+            self.requeue(events)
+            raise
+        else:
+            self.written(events)
+        finally:
+            self._flushing = {}
+            self._flushed = None
+            flushed.set()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Flush of summary increments failed')
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+def count_pipeline(events=None):
+    """Aggregation of summary documents from the reactions."""
+    pipeline = [] if events is None else [{'$match': {'event': {'$in': events}}}]
+    return pipeline + [
+        {'$group': {
+            '_id': '$event',
+            'positive': {'$sum': {
+                '$cond': [{'$eq': ['$type', ReactionType.POSITIVE.value]}, 1, 0]
+            }},
+            'negative': {'$sum': {
+                '$cond': [{'$eq': ['$type', ReactionType.NEGATIVE.value]}, 1, 0]
+            }},
+        }},
+        {'$project': {
+            '_id': False,
+            'event': '$_id',
+            'positive': True,
+            'negative': True,
+            'score': {'$subtract': ['$positive', '$negative']},
+        }},
+    ]
+
+
+async def count_summary(db, event):
+    """Summary document of the event counted from its reactions."""
+    docs = await db.reactions.aggregate(count_pipeline([event])).to_list(None)
+    if docs:
+        return docs[0]
+    return {'event': event, 'positive': 0, 'negative': 0, 'score': 0}
+
+
+async def backfill_summaries(db):
+    """
+    Insert summary documents of the events which have reactions but no summary.
+
+    Existing summaries are left as they are, so it is safe to run along with
+    the toggles, unlike the rebuild.
+
+    Returns:
+        int: number of inserted summaries
+    """
+    inserted = 0
+    requests = []
+    async for doc in db.reactions.aggregate(count_pipeline(), allowDiskUse=True):
+        requests.append(UpdateOne({'event': doc['event']}, {'$setOnInsert': doc}, upsert=True))
+        if len(requests) >= REBUILD_BATCH_SIZE:
+            result = await db.reaction_summaries.bulk_write(requests, ordered=False)
+            inserted += result.upserted_count
+            requests = []
+    if requests:
+        result = await db.reaction_summaries.bulk_write(requests, ordered=False)
+        inserted += result.upserted_count
+    return inserted
+
+
+async def rebuild_summaries(db, events=None):
+    """
+    Replace summary documents with counters of the reactions.
+
+    Summaries which are created by toggles while the rebuild runs are
+    removed with the stale ones, so run it while reactions are not written.
+
+    Args:
+        db (AsyncIOMotorDatabase): reactions database
+        events (list): ids of rebuilt events, all events if None
+
+    Returns:
+        int: number of rebuilt summaries
+    """
+    # rebuilt summaries are marked, so unmarked ones are left by removed reactions
+    rebuild = uuid.uuid4()
+    rebuilt = 0
+    requests = []
+    async for doc in db.reactions.aggregate(count_pipeline(events), allowDiskUse=True):
+        doc['rebuild'] = rebuild
+        requests.append(ReplaceOne({'event': doc['event']}, doc, upsert=True))
+        if len(requests) >= REBUILD_BATCH_SIZE:
+            await db.reaction_summaries.bulk_write(requests, ordered=False)
+            rebuilt += len(requests)
+            requests = []
+    if requests:
+        await db.reaction_summaries.bulk_write(requests, ordered=False)
+        rebuilt += len(requests)
+
+    stale = {'rebuild': {'$ne': rebuild}}
+    if events is not None:
+        stale['event'] = {'$in': events}
+    await db.reaction_summaries.delete_many(stale)
+    return rebuilt
+
+
+async def dedupe_reactions(db):
+    """
+    Remove duplicate reactions of the users and rebuild summaries of their events.
+
+    The latest changed reaction of the user to the event is kept. Duplicates
+    are left by the toggle which was not atomic and fail the build of the
+    unique (event, user.id) index.
+
+    Returns:
+        int: number of removed reactions
+    """
+    duplicates = db.reactions.aggregate([
+        {'$group': {
+            '_id': {'event': '$event', 'user': '$user.id'},
+            'count': {'$sum': 1},
+        }},
+        {'$match': {'count': {'$gt': 1}}},
+    ], allowDiskUse=True)
+    removed = 0
+    events = []
+    async for duplicate in duplicates:
+        event = duplicate['_id']['event']
+        cursor = db.reactions.find(
+            {'event': event, 'user.id': duplicate['_id']['user']},
+            projection={'_id': True},
+            sort=[('changed', -1)],
+            skip=1
+        )
+        ids = [doc['_id'] async for doc in cursor]
+        result = await db.reactions.delete_many({'_id': {'$in': ids}})
+        removed += result.deleted_count
+        events.append(event)
+    for idx in range(0, len(events), REBUILD_BATCH_SIZE):
+        await rebuild_summaries(db, events[idx:idx + REBUILD_BATCH_SIZE])
+    return removed
+
+
+async def check_summaries(db):
+    """
+    Compare summary documents with counters of the reactions.
+
+    Returns:
+        list: pairs of counted and stored summaries which differ
+    """
+    stored = {}
+    async for doc in db.reaction_summaries.find(projection={'_id': False}):
+        stored[doc['event']] = doc
+    mismatches = []
+    async for counted in db.reactions.aggregate(count_pipeline(), allowDiskUse=True):
+        summary = stored.pop(counted['event'], None)
+        if summary is None or any(
+            summary.get(field, 0) != counted[field]
+            for field in ('positive', 'negative', 'score')
+        ):
+            mismatches.append((counted, summary))
+    for summary in stored.values():
+        if summary.get('positive', 0) or summary.get('negative', 0):
+            mismatches.append((None, summary))
+    return mismatches
+
+
+async def main(command, events):
+    DATABASE_HOST = os.getenv('DATABASE_HOST', 'localhost')
+    DATABASE_PORT = int(os.getenv('DATABASE_PORT', 27017))
+    client = AsyncIOMotorClient(DATABASE_HOST, DATABASE_PORT, uuidRepresentation='standard')
+    try:
+        if command == 'rebuild':
+            rebuilt = await rebuild_summaries(client.reactions, events)
+            print(f'rebuilt summaries: {rebuilt}')
+            return 0
+        if command == 'dedupe':
+            removed = await dedupe_reactions(client.reactions)
+            print(f'removed duplicate reactions: {removed}')
+            return 0
+        mismatches = await check_summaries(client.reactions)
+        for counted, summary in mismatches:
+            print(f'counted: {counted}, stored: {summary}')
+        print(f'inconsistent summaries: {len(mismatches)}')
+        return 1 if mismatches else 0
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['rebuild', 'dedupe', 'check'])
+    parser.add_argument('--event', type=uuid.UUID, action='append', dest='events')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.command, args.events)))
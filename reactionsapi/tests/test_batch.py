@@ -0,0 +1,61 @@
+import uuid
+
+import pytest
+
+import main
+from tests.conftest import reaction
+
+FIRST = uuid.UUID(int=1)
+SECOND = uuid.UUID(int=2)
+EMPTY = uuid.UUID(int=3)
+
+
+@pytest.fixture
+async def reactions(db):
+    user = await main.get_user()
+    await db.reactions.insert_many([
+        reaction(FIRST, user=user.id),
+        reaction(FIRST),
+        reaction(SECOND, 'NEGATIVE'),
+    ])
+    await db.reaction_summaries.insert_many([
+        {'event': FIRST, 'positive': 2, 'negative': 0, 'score': 2},
+        {'event': SECOND, 'positive': 0, 'negative': 1, 'score': -1},
+    ])
+    return db
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('reactions')
+async def test_event_summaries(api):
+    events = [str(event) for event in (SECOND, EMPTY, FIRST, SECOND)]
+    response = await api.post('/events/summaries', json={'events': events})
+    assert response.status_code == 200
+    assert response.json() == [
+        {'event': str(SECOND), 'score': -1, 'reaction': None},
+        {'event': str(EMPTY), 'score': 0, 'reaction': None},
+        {'event': str(FIRST), 'score': 2, 'reaction': None},
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('reactions')
+async def test_event_summaries_reaction(api):
+    events = [str(FIRST), str(SECOND)]
+    response = await api.post(
+        '/events/summaries', json={'events': events, 'include_reaction': True}
+    )
+    assert [summary['reaction'] for summary in response.json()] == ['POSITIVE', None]
+
+
+@pytest.mark.asyncio
+async def test_event_summaries_limit(api, monkeypatch):
+    monkeypatch.setattr(main, 'SUMMARIES_MAX_EVENTS', 2)
+    events = [str(uuid.UUID(int=idx)) for idx in range(3)]
+    response = await api.post('/events/summaries', json={'events': events})
+    assert response.status_code == 400
+
+    # duplicate ids are counted once
+    response = await api.post('/events/summaries', json={'events': events[:2] * 2})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
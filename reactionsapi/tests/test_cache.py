@@ -0,0 +1,83 @@
+import asyncio
+import uuid
+
+import pytest
+
+import main
+from cache import SummaryCache
+
+EVENT = uuid.UUID(int=1)
+
+
+@pytest.fixture
+async def cache(db, monkeypatch):
+    cache = SummaryCache(db.reaction_summaries)
+    monkeypatch.setattr(main, 'summary_cache', cache)
+    yield cache
+    cache.stop()
+
+
+async def summary(api, **headers):
+    response = await api.get(f'/events/{EVENT}/summary', headers=headers)
+    assert response.status_code == 200
+    return response.json(), response.headers['X-Cache']
+
+
+@pytest.mark.asyncio
+async def test_summary_cache(api, db, cache):
+    assert await summary(api) == (0, 'MISS')
+    assert await summary(api) == (0, 'HIT')
+
+    await db.reaction_summaries.insert_one({'event': EVENT, 'score': 3})
+    assert await summary(api) == (0, 'HIT')
+    assert await summary(api, **{'X-Cache-Bypass': '1'}) == (3, 'BYPASS')
+
+    cache.invalidate(EVENT)
+    assert await summary(api) == (3, 'MISS')
+    assert cache.as_dict()['hits'] == 2
+    assert cache.as_dict()['misses'] == 2
+
+
+@pytest.mark.asyncio
+async def test_toggle_invalidates_summary(api, cache):
+    # scores written by the worker are dropped before the change stream does it
+    cache.watching = True
+    assert await summary(api) == (0, 'MISS')
+    response = await api.post(f'/events/{EVENT}/toggle', json={'type': 'POSITIVE'})
+    assert response.json() == 1
+    assert await summary(api) == (1, 'MISS')
+
+
+@pytest.mark.asyncio
+async def test_loaded_score_of_invalidated_event(cache):
+    async def load(event):
+        # the score changes while it is loaded
+        cache.invalidate(event)
+        return 1
+
+    assert await cache.get_or_load(EVENT, load) == (1, False)
+    assert await cache.get_or_load(EVENT, load) == (1, False)
+
+
+@pytest.mark.asyncio
+async def test_change_stream_invalidation(db, cache):
+    cache.start()
+    for _ in range(50):
+        if cache.watching:
+            break
+        await asyncio.sleep(0.1)
+    else:
+        pytest.skip('Change streams need a replica set')
+
+    async def load(event):
+        doc = await db.reaction_summaries.find_one({'event': event})
+        return doc['score'] if doc is not None else 0
+
+    assert await cache.get_or_load(EVENT, load) == (0, False)
+    await db.reaction_summaries.insert_one({'event': EVENT, 'score': 2})
+    for _ in range(50):
+        score, cached = await cache.get_or_load(EVENT, load)
+        if not cached:
+            break
+        await asyncio.sleep(0.1)
+    assert score == 2
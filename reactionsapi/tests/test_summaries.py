@@ -0,0 +1,104 @@
+import uuid
+
+import pytest
+
+from summaries import (
+    backfill_summaries,
+    check_summaries,
+    increment_summary,
+    rebuild_summaries,
+    reaction_increment,
+)
+from tests.conftest import reaction
+
+FIRST = uuid.UUID(int=1)
+SECOND = uuid.UUID(int=2)
+STALE = uuid.UUID(int=3)
+
+
+@pytest.fixture
+async def reactions(db):
+    await db.reactions.insert_many([
+        reaction(FIRST),
+        reaction(FIRST),
+        reaction(FIRST, 'NEGATIVE'),
+        reaction(SECOND, 'NEGATIVE'),
+    ])
+    await db.reaction_summaries.insert_many([
+        {'event': FIRST, 'positive': 2, 'negative': 0, 'score': 2},
+        {'event': STALE, 'positive': 1, 'negative': 0, 'score': 1},
+    ])
+    return db
+
+
+def summary(event, positive, negative):
+    return {
+        'event': event,
+        'positive': positive,
+        'negative': negative,
+        'score': positive - negative,
+    }
+
+
+async def stored_summaries(db):
+    cursor = db.reaction_summaries.find(
+        projection={'_id': False, 'rebuild': False}, sort=[('event', 1)]
+    )
+    return await cursor.to_list(None)
+
+
+@pytest.mark.asyncio
+async def test_check_summaries(reactions):
+    mismatches = await check_summaries(reactions)
+    assert len(mismatches) == 3
+    assert (summary(FIRST, 2, 1), summary(FIRST, 2, 0)) in mismatches
+    assert (summary(SECOND, 0, 1), None) in mismatches
+    assert (None, summary(STALE, 1, 0)) in mismatches
+
+
+@pytest.mark.asyncio
+async def test_rebuild_summaries(reactions):
+    assert await rebuild_summaries(reactions) == 2
+    assert await stored_summaries(reactions) == [
+        summary(FIRST, 2, 1),
+        summary(SECOND, 0, 1),
+    ]
+    assert await check_summaries(reactions) == []
+
+
+@pytest.mark.asyncio
+async def test_rebuild_selected_summaries(reactions):
+    assert await rebuild_summaries(reactions, [SECOND, STALE]) == 1
+    assert await stored_summaries(reactions) == [
+        summary(FIRST, 2, 0),
+        summary(SECOND, 0, 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_increment_seeds_missing_summary(reactions):
+    # reaction of the toggle is written before the increment of the summary
+    added = reaction(SECOND)
+    await reactions.reactions.insert_one(added)
+    assert await increment_summary(reactions, SECOND, reaction_increment('POSITIVE')) == 0
+    assert summary(SECOND, 1, 1) in await stored_summaries(reactions)
+
+    await reactions.reactions.delete_one({'id': added['id']})
+    assert await increment_summary(reactions, SECOND, reaction_increment('POSITIVE', -1)) == -1
+    assert summary(SECOND, 0, 1) in await stored_summaries(reactions)
+
+
+@pytest.mark.asyncio
+async def test_increment_existing_summary(reactions):
+    assert await increment_summary(reactions, FIRST, reaction_increment('NEGATIVE')) == 1
+    assert summary(FIRST, 2, 1) in await stored_summaries(reactions)
+
+
+@pytest.mark.asyncio
+async def test_backfill_summaries(reactions):
+    assert await backfill_summaries(reactions) == 1
+    assert await stored_summaries(reactions) == [
+        summary(FIRST, 2, 0),
+        summary(SECOND, 0, 1),
+        summary(STALE, 1, 0),
+    ]
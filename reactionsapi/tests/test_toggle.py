@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import main
+from database import ensure_indexes
+from summaries import check_summaries, increment_summary, reaction_increment
+from tests.conftest import reaction
+
+EVENT = uuid.UUID(int=1)
+
+
+async def toggle(api, type='POSITIVE'):
+    response = await api.post(f'/events/{EVENT}/toggle', json={'type': type})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_toggle(api, db):
+    assert await toggle(api) == 1
+    assert await toggle(api, 'NEGATIVE') == -1
+    assert await toggle(api, 'NEGATIVE') == 0
+    assert await db.reactions.count_documents({}) == 0
+    assert await check_summaries(db) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('toggles', [4, 5])
+async def test_toggle_concurrently(api, db, toggles):
+    # toggles are not serialized, so the final reaction depends on their order
+    await asyncio.gather(*(toggle(api) for _ in range(toggles)))
+    count = await db.reactions.count_documents({})
+    assert count in (0, 1)
+    assert await main.get_summary_score(db, EVENT) == count
+    assert await check_summaries(db) == []
+
+
+@pytest.mark.asyncio
+async def test_toggle_duplicate_key_retry(api, db, monkeypatch):
+    upsert_reaction = main.upsert_reaction
+    raced = []
+
+    async def racing_upsert_reaction(collection, instance):
+        if not raced:
+            raced.append(instance)
+            # the concurrent toggle of the user inserts the reaction first
+            await upsert_reaction(collection, instance)
+            await increment_summary(db, EVENT, reaction_increment(instance.type))
+            raise DuplicateKeyError('E11000 duplicate key error')
+        return await upsert_reaction(collection, instance)
+
+    monkeypatch.setattr(main, 'upsert_reaction', racing_upsert_reaction)
+    assert await toggle(api) == 1
+    assert raced
+    assert await db.reactions.count_documents({}) == 1
+    assert await check_summaries(db) == []
+
+
+@pytest.mark.asyncio
+async def test_dedupe_before_unique_index(db):
+    await db.reactions.drop_indexes()
+    user = uuid.uuid4()
+    latest = dict(reaction(EVENT, 'NEGATIVE', user), changed=datetime.now())
+    await db.reactions.insert_many([
+        dict(reaction(EVENT, user=user), changed=latest['changed'] - timedelta(1)),
+        latest,
+        reaction(EVENT),
+    ])
+
+    await ensure_indexes(db)
+    assert (await db.reactions.index_information())['event_user']['unique']
+    ids = [doc['id'] async for doc in db.reactions.find({'user.id': user})]
+    assert ids == [latest['id']]
+    assert await main.get_summary_score(db, EVENT) == 0
+    assert await check_summaries(db) == []
@@ -0,0 +1,124 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from summaries import SummaryWriter, get_summary_score
+
+FIRST = uuid.UUID(int=1)
+SECOND = uuid.UUID(int=2)
+
+
+class FailingCollection:
+    """Stand-in of the summaries collection whose bulk write fails with error."""
+
+    def __init__(self, error):
+        self.error = error
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.requests.append(requests)
+        raise self.error
+
+    async def find_one(self, *args, **kwargs):
+        return None
+
+
+class BlockedCollection:
+    """Stand-in of the summaries collection whose bulk write is applied but not answered."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.applied = asyncio.Event()
+        self.answer = asyncio.Event()
+
+    async def bulk_write(self, requests, ordered=True):
+        result = await self.collection.bulk_write(requests, ordered=ordered)
+        self.applied.set()
+        await self.answer.wait()
+        return result
+
+    async def find_one(self, *args, **kwargs):
+        return await self.collection.find_one(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_writer_coalesces_increments(db):
+    flushed = []
+    writer = SummaryWriter(db, on_flush=flushed.extend)
+    assert await writer.increment(FIRST, {'positive': 1, 'score': 1}) == 1
+    assert await writer.increment(FIRST, {'positive': 1, 'score': 1}) == 2
+    assert await writer.increment(SECOND, {'negative': 1, 'score': -1}) == -1
+    assert await get_summary_score(db, FIRST) == 0
+
+    await writer.flush()
+    assert await get_summary_score(db, FIRST) == 2
+    assert await get_summary_score(db, SECOND) == -1
+    assert flushed == [FIRST, SECOND]
+
+
+@pytest.mark.asyncio
+async def test_writer_requeues_failed_writes():
+    error = BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000}]})
+    collection = FailingCollection(error)
+    flushed = []
+    writer = SummaryWriter(SimpleNamespace(reaction_summaries=collection), on_flush=flushed.extend)
+    await writer.increment(FIRST, {'positive': 1, 'score': 1})
+    await writer.increment(SECOND, {'positive': 1, 'score': 1})
+
+    with pytest.raises(BulkWriteError):
+        await writer.flush()
+    assert flushed == [FIRST]
+    assert writer.unwritten_score(FIRST) == 0
+    assert writer.unwritten_score(SECOND) == 1
+
+
+@pytest.mark.asyncio
+async def test_writer_drops_ambiguous_writes():
+    collection = FailingCollection(AutoReconnect('connection closed'))
+    writer = SummaryWriter(SimpleNamespace(reaction_summaries=collection))
+    await writer.increment(FIRST, {'positive': 1, 'score': 1})
+
+    with pytest.raises(AutoReconnect):
+        await writer.flush()
+    assert writer.unwritten_score(FIRST) == 0
+
+    await writer.flush()
+    assert len(collection.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_writer_score_during_flush(db):
+    collection = BlockedCollection(db.reaction_summaries)
+    writer = SummaryWriter(SimpleNamespace(reaction_summaries=collection))
+    await writer.increment(FIRST, {'positive': 1, 'score': 1})
+    flush = asyncio.ensure_future(writer.flush())
+    await collection.applied.wait()
+
+    # the applied increment of the flush in flight is not counted twice
+    increment = asyncio.ensure_future(writer.increment(FIRST, {'positive': 1, 'score': 1}))
+    await asyncio.sleep(0)
+    collection.answer.set()
+    await flush
+    assert await increment == 2
+
+
+@pytest.mark.asyncio
+async def test_writer_run_survives_errors(db, caplog):
+    writer = SummaryWriter(db, interval=0)
+    flushes = []
+
+    async def failing_flush():
+        flushes.append(None)
+        if len(flushes) == 1:
+            raise ValueError('unexpected')
+        writer._task.cancel()
+
+    writer.flush = failing_flush
+    writer.start()
+    with pytest.raises(asyncio.CancelledError):
+        await writer._task
+    assert len(flushes) == 2
+    assert 'Flush of summary increments failed' in caplog.text